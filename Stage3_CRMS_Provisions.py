@@ -1,9 +1,22 @@
+import os
+import tempfile
 import pandas as pd
-from datetime import datetime, timedelta
 import streamlit as st
 
-# Write-up explaining the calculation
-st.markdown("""
+import data_io
+import instrumentation
+import job_runner
+import result_export
+import upload_cache
+from provisions import (
+    INPUT_COLUMNS, INPUT_SCHEMA, provision_totals, calculate_provisions_chunked,
+    apply_provision_delta, check_provision_delta, quarter_end_dates, calculate_provision_sweep,
+    calculate_provisions_parallel, calculate_provisions_in_blocks, final_columns,
+)
+
+# Write-up explaining the calculation, shown at the top of the app
+def show_write_up():
+    st.markdown("""
 # Minimum Provision Calculation based on CRMS (CBUAE Guidelines)
 
 This app calculates the minimum provision required for Stage 3 (Wholesale Obligors) under the CRMS guidelines published by the Central Bank of the UAE (CBUAE). The calculation follows the steps outlined in **Article 9.23 - Minimum provision for Stage 3 (Wholesale Obligors)**.
@@ -33,10 +46,10 @@ To perform the calculation, the following columns are required in your input dat
 ### Input Data Format:
 Below is the sample format for the input data that you should upload:
 """)
-# Use st.image() to display an image of the input data format
-st.image("https://github.com/ManuChakkingal049/LearnStreamLit/blob/main/input_data_sample.png?raw=true", caption="Input Data Format Example")
+    # Use st.image() to display an image of the input data format
+    st.image("https://github.com/ManuChakkingal049/LearnStreamLit/blob/main/input_data_sample.png?raw=true", caption="Input Data Format Example")
 
-st.markdown("""
+    st.markdown("""
 
 ### Key Steps:
 
@@ -87,132 +100,243 @@ You can upload your dataset (CSV file format), enter the **CRMS Issue Date** and
 The calculation logic is implemented using the following code.
 """)
 
-# Load the CSV file into a DataFrame
-def load_data(file_path):
-    return pd.read_csv(file_path)
-
-# Convert string to date
-def convert_to_date(date_string):
-    return datetime.strptime(date_string, "%d-%b-%Y")
-
-# Calculate years since NPL
-def calculate_years_since_npl(classification_date, run_date):
-    return (run_date - classification_date).days / 365
-
-# Main calculation function
-def calculate_provisions(df, crms_issue_date_str, run_date_str):
-    # Convert date columns to datetime objects
-    crms_issue_date = convert_to_date(crms_issue_date_str)
-    run_date = convert_to_date(run_date_str)
-    
-    # Fill missing values in key columns with 0 (or use other default values based on the use case)
-    df['TOTAL OS'] = df['TOTAL OS'].fillna(0)
-    df['Collateral after H.C'] = df['Collateral after H.C'].fillna(0)
-    df['Unsecured Portion Covered by ECF/DCF'] = df['Unsecured Portion Covered by ECF/DCF'].fillna(0)
-    df['Existing ECL held Q3\'24'] = df['Existing ECL held Q3\'24'].fillna(0)
-    
-    # Ensure 'Classification Date' column is in datetime format, fill any NaT (Not a Time) values with a default date if necessary
-    df['Classification Date'] = pd.to_datetime(df['Classification date'], errors='coerce').fillna(pd.to_datetime('01-Jan-2000'))
-
-    # Calculate the years since NPL
-    df['Years Since NPL'] = df['Classification Date'].apply(lambda x: calculate_years_since_npl(x, run_date))
-    
-    # Calculate Unsecured Portion
-    df['Unsecured Portion (as whole)'] = df.apply(
-        lambda row: max(row['TOTAL OS'] - row['Collateral after H.C'], 0), axis=1
-    )
-    
-    # Calculate NET SECURED Portion
-    df['NET SECURED Portion'] = df.apply(
-        lambda row: min(row['Collateral after H.C'], row['TOTAL OS']), axis=1
-    )
-    
-    # Calculate NET Unsecured Portion (NUSP)
-    df['NET Unsecured Portion (NUSP)'] = df['Unsecured Portion (as whole)'] - df['Unsecured Portion Covered by ECF/DCF']
-    
-    # Calculate Min. Provision Required on NUSP (A)
-    df['Min. Provision Required on NUSP (A)'] = df['NET Unsecured Portion (NUSP)']
-    
-    # Calculate Min. Provision Required on NUSP (B)
-    four_years_after_crms = crms_issue_date + timedelta(days=4*365)  # Add 4 years to CRMS issue date
-    df['Min. Provision Required on NUSP (B)'] = df.apply(
-        lambda row: row['Unsecured Portion (as whole)'] * 1 if run_date >= four_years_after_crms else row['Unsecured Portion (as whole)'] * 0.25,
-        axis=1
-    )
-    
-    # Calculate final provision for Unsecured Portion
-    df['Provision Unsecured Portion'] = df.apply(
-        lambda row: max(row['Min. Provision Required on NUSP (A)'], row['Min. Provision Required on NUSP (B)']),
-        axis=1
-    )
-    
-    # Calculate Min. Provision on entire SECURED Portion
-    df['Min. Provision on entire SECURED Portion'] = df.apply(
-        lambda row: row['NET SECURED Portion'] * 0.25 if row['Years Since NPL'] > 4 else 0,
-        axis=1
-    )
-    
-    # Calculate FINAL Required Provision/ECL CRMS
-    df['FINAL Required Provision/ECL CRMS'] = df['Provision Unsecured Portion'] + df['Min. Provision on entire SECURED Portion']
-    
-    # Calculate Final Calculated ECL with Q3 2024 floor
-    df['Final Calculated ECL with Q3 2024 floor'] = df.apply(
-        lambda row: max(row['FINAL Required Provision/ECL CRMS'], row['Existing ECL held Q3\'24']),
-        axis=1
-    )
-    
-    # Calculate ratio of Existing ECL Q3'24 to Total OS
-    df['Ratio Existing ECL Q3\'24 to Total OS'] = df.apply(
-        lambda row: row['Existing ECL held Q3\'24'] / row['TOTAL OS'] if row['TOTAL OS'] != 0 else 0,
-        axis=1
-    )
-    
-    # Calculate Final ECL with OS considered based on the updated condition
-    df['Final ECL with OS considered'] = df.apply(
-        lambda row: max(row['FINAL Required Provision/ECL CRMS'], row['TOTAL OS']) if row['Ratio Existing ECL Q3\'24 to Total OS'] > 1
-        else max(row['FINAL Required Provision/ECL CRMS'], row['Existing ECL held Q3\'24']),
-        axis=1
+# Download of a result set in the chosen format, optionally without the
+# intermediate calculation columns. The file is only written when the button
+# is clicked (on a Streamlit worker thread), not on every rerun.
+def show_result_download(df_result, export_format, final_only=False):
+    columns = final_columns(df_result) if final_only else None
+    extension, mime = result_export.EXPORT_FORMATS[export_format]
+    recorder = instrumentation.current_recorder()
+
+    def export():
+        with recorder.stage("prepare download", rows=len(df_result)):
+            return result_export.export_bytes(df_result, export_format, columns)
+
+    st.download_button(
+        label="Download Results",
+        data=export,
+        file_name="calculated_provisions" + extension,
+        mime=mime
     )
-    
-    return df
+
+# Background job calculating the provisions of a loaded book, with progress
+# per block of loans. Results are cached per upload content, loaded columns,
+# dates and workers; the cached input DataFrame is shared, so the job works
+# on a copy.
+def provision_job(df, file_hash, crms_issue_date_str, run_date_str, workers=1, columns=None):
+    def run(job):
+        def compute():
+            if workers > 1:
+                return calculate_provisions_parallel(df.copy(), crms_issue_date_str, run_date_str, workers=workers, progress=job.report)
+            return calculate_provisions_in_blocks(df.copy(), crms_issue_date_str, run_date_str, progress=job.report), None
+
+        with instrumentation.stage("calculate provisions", rows=len(df)):
+            df_result, timings = upload_cache.cache.get_or_compute(
+                ("provisions", file_hash, repr(columns), crms_issue_date_str, run_date_str, workers), compute
+            )
+        return {"df_result": df_result, "timings": timings}
+    return run
+
+# Background job streaming a large file through the calculation into a
+# temporary file in the chosen download format (compressed as it is written),
+# which is removed when the job is discarded
+def provision_chunked_job(uploaded_file, crms_issue_date_str, run_date_str, export_format, final_only=False):
+    source = data_io.detached_source(uploaded_file)
+    extension = result_export.EXPORT_FORMATS[export_format][0]
+
+    def run(job):
+        with tempfile.NamedTemporaryFile(suffix=extension, delete=False) as output_file:
+            output_path = output_file.name
+        job.cleanup.append(lambda: os.path.exists(output_path) and os.remove(output_path))
+        with instrumentation.stage("chunked calculation"):
+            totals = calculate_provisions_chunked(
+                source, output_path, crms_issue_date_str, run_date_str, progress=job.report,
+                export_format=export_format, final_only=final_only
+            )
+            instrumentation.set_rows(totals['Loans'])
+        return {"totals": totals, "output_path": output_path, "export_format": export_format}
+    return run
+
+# Progress, errors or results of a provision job
+def show_provision_job(job, export_format=None, final_only=False):
+    job_runner.show_job_progress(job)
+    if job.status == "failed":
+        st.error(f"Error: {job.error}")
+        return
+    if job.status == "cancelled":
+        st.warning("The calculation was cancelled.")
+        return
+    if job.status != "done":
+        return
+
+    st.caption(f"{job.name}, calculated in {job.seconds():.1f} s")
+    if "totals" in job.result:
+        # Show the portfolio totals collected while streaming
+        st.write("Calculation Summary:")
+        st.write(pd.DataFrame([job.result["totals"]]))
+
+        # Download button for the result, already written in the chosen
+        # format; it is read from disk when clicked
+        output_path = job.result["output_path"]
+        extension, mime = result_export.EXPORT_FORMATS[job.result["export_format"]]
+
+        def read_result():
+            with open(output_path, "rb") as result_file:
+                return result_file.read()
+
+        st.download_button(
+            label="Download Results",
+            data=read_result,
+            file_name="calculated_provisions" + extension,
+            mime=mime
+        )
+        return
+
+    df_result, timings = job.result["df_result"], job.result["timings"]
+    if timings is not None:
+        with st.expander("Partition Timings"):
+            st.write(timings)
+
+    # Show the resulting dataframe
+    st.write("Calculation Results:")
+    with instrumentation.stage("display results", rows=len(df_result)):
+        st.write(df_result)
+
+    # Download button for the result
+    if export_format is not None:
+        show_result_download(df_result, export_format, final_only)
+
+# Streamlit section for the run date sweep
+def show_provision_sweep(df, file_hash):
+    crms_issue_dates_str = st.text_input("Enter CRMS Issue Dates (DD-MMM-YYYY, comma separated)", value="31-Oct-2024")
+    start_date_str = st.text_input("Enter Sweep Start Date (DD-MMM-YYYY)", value="22-Mar-2025")
+    years = st.number_input("Years of quarter-ends", min_value=1, max_value=30, value=5)
+
+    if st.button("Calculate Provision Sweep"):
+        try:
+            crms_issue_date_strs = [date_str.strip() for date_str in crms_issue_dates_str.split(",") if date_str.strip()]
+            run_date_strs = quarter_end_dates(start_date_str, years=int(years))
+            summary = upload_cache.cache.get_or_compute(
+                ("sweep", file_hash, tuple(crms_issue_date_strs), tuple(run_date_strs)),
+                lambda: calculate_provision_sweep(df.copy(), crms_issue_date_strs, run_date_strs)
+            )
+
+            st.write("Provision by Run Date:")
+            st.dataframe(summary)
+            st.line_chart(summary.pivot(index='Run Date', columns='CRMS Issue Date', values='Final ECL with OS considered'))
+        except Exception as e:
+            st.error(f"Error: {e}")
+
+# Streamlit section for the incremental update: the main upload is the
+# previous result set, a second upload holds the changed facilities
+def show_provision_delta(df_previous):
+    delta_file = st.file_uploader("Upload the delta CSV file (changed, new or removed facilities)", type=data_io.UPLOAD_TYPES, key="delta_file")
+    id_col = st.selectbox("Select Loan/Obligor ID column", options=df_previous.columns)
+    crms_issue_date_str = st.text_input("Enter CRMS Issue Date (DD-MMM-YYYY)", value="31-Oct-2024")
+    run_date_str = st.text_input("Enter Run Date (DD-MMM-YYYY)", value="22-Mar-2025")
+    verify = st.checkbox("Verify against a full recalculation", value=False)
+    export_format = st.selectbox("Download format", result_export.export_formats(len(df_previous)), key="delta_format")
+    st.caption("Rows of the delta file with 'Remove' in an 'Action' column remove the facility.")
+
+    if delta_file is not None and st.button("Update Provisions"):
+        try:
+            delta = upload_cache.read_table(delta_file, schema=INPUT_SCHEMA)
+            df_result, totals = apply_provision_delta(df_previous, delta, id_col, crms_issue_date_str, run_date_str)
+
+            st.write("Updated Totals:")
+            st.write(pd.DataFrame([provision_totals(df_previous), totals], index=["Previous", "Updated"]))
+            if verify:
+                st.write("Verification:", check_provision_delta(df_previous, delta, df_result, totals, id_col, crms_issue_date_str, run_date_str))
+
+            st.write("Calculation Results:")
+            st.write(df_result)
+            show_result_download(df_result, export_format)
+        except Exception as e:
+            st.error(f"Error: {e}")
 
 # Streamlit app
 def main():
+    show_write_up()
+
     st.title("Provision Calculation App")
 
     # File upload
-    uploaded_file = st.file_uploader("Upload your CSV file", type=["csv"])
+    uploaded_file = st.file_uploader("Upload your CSV, Parquet or Feather file", type=data_io.UPLOAD_TYPES)
 
     if uploaded_file is not None:
+        mode = st.radio("Mode", ["Single run date", "Run date sweep", "Incremental update"], horizontal=True)
+
+        # Large files are streamed through the calculation instead of loaded whole
+        chunked = mode == "Single run date" and st.checkbox("Process large file in chunks", value=False)
+
         # Load the data
-        df = pd.read_csv(uploaded_file)
-        st.write("Data Preview:")
-        st.write(df.head())
+        columns = None
+        if chunked:
+            df = None
+            st.write("Data Preview:")
+            st.write(data_io.read_preview(uploaded_file))
+        else:
+            # Optionally read only the columns the calculation needs
+            if mode != "Incremental update" and st.checkbox("Load only the calculation columns", value=False):
+                columns = ['Classification date'] + INPUT_COLUMNS
+            with instrumentation.stage("read input"):
+                df = upload_cache.read_table(uploaded_file, columns=columns, schema=INPUT_SCHEMA)
+                instrumentation.set_rows(len(df))
+            st.write("Data Preview:")
+            st.write(df.head())
+
+        file_hash = upload_cache.content_hash(uploaded_file)
+        if mode == "Run date sweep":
+            show_provision_sweep(df, file_hash)
+            return
+        if mode == "Incremental update":
+            show_provision_delta(df)
+            return
 
         # User inputs
         crms_issue_date_str = st.text_input("Enter CRMS Issue Date (DD-MMM-YYYY)", value="31-Oct-2024")
         run_date_str = st.text_input("Enter Run Date (DD-MMM-YYYY)", value="22-Mar-2025")
+        workers = 1
+        if not chunked:
+            workers = st.number_input("Worker processes", min_value=1, max_value=os.cpu_count() or 1, value=1)
+
+        # Download options, chosen before the calculation so that changing
+        # them does not clear the results. The chunked run writes its output
+        # in the chosen format, so there they are part of the calculation.
+        export_format = st.selectbox("Download format", result_export.export_formats(None if chunked else len(df)))
+        final_only = st.checkbox("Final columns only", value=False)
+        output_options = (export_format, final_only) if chunked else None
+
+        # Button to perform calculation. The calculation runs as a background
+        # job; its ID is kept in the session with the upload, dates and
+        # options it was started for, so the results survive reruns but are
+        # dropped (and the job cancelled) once any of these change.
+        job_key = (upload_cache.content_hash(uploaded_file), crms_issue_date_str, run_date_str, int(workers), repr(columns), chunked, output_options)
+        current = st.session_state.get("provision_job")
+        if current is not None and current[0] != job_key:
+            job_runner.runner.discard(current[1])
+            del st.session_state.provision_job
+            current = None
 
-        # Button to perform calculation
         if st.button("Calculate Provisions"):
-            # Ensure valid date format
-            try:
-                df_result = calculate_provisions(df, crms_issue_date_str, run_date_str)
-                
-                # Show the resulting dataframe
-                st.write("Calculation Results:")
-                st.write(df_result)
-
-                # Download button for the result
-                csv = df_result.to_csv(index=False)
-                st.download_button(
-                    label="Download Results",
-                    data=csv,
-                    file_name="calculated_provisions.csv",
-                    mime="text/csv"
-                )
-            except Exception as e:
-                st.error(f"Error: {e}")
+            if current is not None:
+                job_runner.runner.discard(current[1])
+            if chunked:
+                run = provision_chunked_job(uploaded_file, crms_issue_date_str, run_date_str, export_format, final_only)
+            else:
+                run = provision_job(df, file_hash, crms_issue_date_str, run_date_str, int(workers), columns=columns)
+            job_id = job_runner.runner.submit(job_runner.session_id(), f"Provisions for {crms_issue_date_str} / {run_date_str}", run)
+            current = (job_key, job_id)
+            st.session_state.provision_job = current
+            job_runner.runner.wait(job_id, timeout=job_runner.QUICK_JOB_SECONDS)
+
+        job = job_runner.runner.get(current[1]) if current is not None else None
+        if job is not None:
+            show_provision_job(job, export_format, final_only)
 
 if __name__ == "__main__":
+    recorder = instrumentation.session_recorder("provisions")
     main()
+    instrumentation.show_sidebar_panel(recorder)
+    st.sidebar.write("Upload Cache:", upload_cache.cache.stats())
+    st.sidebar.write("Background Jobs:", job_runner.runner.stats())
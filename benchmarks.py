@@ -0,0 +1,249 @@
+# Benchmarks of the apps' hot paths on a synthetic wholesale portfolio.
+#
+#   python benchmarks.py run --sizes 10k 100k 1M 10M --output results.json
+#   python benchmarks.py compare baseline.json results.json --threshold 0.1
+#
+# run times every benchmark at every portfolio size (best of --repeat runs)
+# and measures its peak memory in one more run under tracemalloc, which sees
+# the numpy/pandas and Python allocations but not Arrow's own buffers.
+# compare exits with status 1 when any benchmark got slower or bigger than
+# the threshold allows.
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import group_aggregation
+import profiling
+import provisions
+
+DEFAULT_SIZES = ["10k", "100k", "1M", "10M"]
+DEFAULT_SEED = 42
+
+# Dates used by the provision benchmarks
+CRMS_ISSUE_DATE = "31-Oct-2020"
+RUN_DATE = "30-Sep-2025"
+
+SEGMENTS = ["Corporate", "SME", "Real Estate", "Trade Finance", "Government", "Financial Institutions"]
+SEGMENT_SHARES = [0.35, 0.25, 0.15, 0.1, 0.05, 0.1]
+STAGE_SHARES = [0.8, 0.15, 0.05]
+STAGE_LOSS_RATES = np.array([0.005, 0.04, 0.45])  # PD x LGD per stage
+SCENARIO_FACTORS = {"ECL Baseline": 1.0, "ECL Upturn": 0.8, "ECL Downturn": 1.45}
+
+KEY_COLS = ["Segment", "Stage"]
+SUM_COLS = ["EAD", "ECL Baseline", "ECL Upturn", "ECL Downturn"]
+
+# Regressions smaller than this are treated as noise
+MIN_SECONDS = 0.01
+MIN_MB = 1.0
+
+
+# Row counts like "10k" or "1M"
+def parse_size(text):
+    multipliers = {"k": 1_000, "m": 1_000_000}
+    text = text.strip().lower()
+    if text[-1] in multipliers:
+        return int(float(text[:-1]) * multipliers[text[-1]])
+    return int(text)
+
+
+# Seeded synthetic wholesale portfolio with the input columns of the
+# provision app (classification dates as DD-MMM-YYYY text, OS, collateral,
+# ECF/DCF cover, Q3'24 ECL) and of the stress test (segment, stage, EAD and
+# scenario ECLs). The same seed and size always give the same portfolio.
+def synthetic_portfolio(rows, seed=DEFAULT_SEED):
+    rng = np.random.default_rng(seed)
+
+    # Classification dates between 2010 and Q3 2024, formatted once per day;
+    # about 1% are missing
+    days = pd.date_range("2010-01-01", "2024-09-30", freq="D")
+    day_strings = np.array(days.strftime("%d-%b-%Y"), dtype=object)
+    classification = day_strings[rng.integers(0, len(days), rows)]
+    classification[rng.random(rows) < 0.01] = None
+
+    total_os = rng.lognormal(mean=14, sigma=1.5, size=rows)
+    secured = rng.random(rows) > 0.3
+    collateral = np.where(secured, total_os * rng.beta(2, 3, rows), 0.0)
+    unsecured = total_os - collateral
+    ecf_dcf = unsecured * rng.beta(1, 4, rows) * (rng.random(rows) < 0.4)
+    existing_ecl = total_os * rng.beta(2, 2, rows)
+
+    stage = rng.choice([1, 2, 3], size=rows, p=STAGE_SHARES)
+    ead = total_os * rng.uniform(1.0, 1.2, rows)
+    baseline_ecl = ead * STAGE_LOSS_RATES[stage - 1] * rng.lognormal(0, 0.3, rows)
+
+    df = pd.DataFrame({
+        "Loan ID": np.arange(rows),
+        "Classification date": classification,
+        "TOTAL OS": total_os,
+        "Collateral after H.C": collateral,
+        "Unsecured Portion Covered by ECF/DCF": ecf_dcf,
+        "Existing ECL held Q3'24": existing_ecl,
+        "Segment": np.array(SEGMENTS, dtype=object)[rng.choice(len(SEGMENTS), size=rows, p=SEGMENT_SHARES)],
+        "Stage": stage,
+        "EAD": ead,
+    })
+    for name, factor in SCENARIO_FACTORS.items():
+        df[name] = baseline_ecl * factor
+    return df
+
+
+# Benchmarks: each prepares its inputs from the portfolio (not timed) and
+# returns the call to time
+def bench_calculate_provisions(portfolio, workdir):
+    # calculate_provisions only adds columns, so repeated runs on the same
+    # frame do the same work
+    df = portfolio[["Classification date"] + provisions.INPUT_COLUMNS].copy()
+    return lambda: provisions.calculate_provisions(df, CRMS_ISSUE_DATE, RUN_DATE)
+
+
+def bench_group_sums(portfolio, workdir):
+    # Same groupby as group_sum.py on the categorical Segment/Stage columns
+    df = portfolio[KEY_COLS + SUM_COLS].astype({"Segment": "category", "Stage": "category"})
+    return lambda: df.groupby(KEY_COLS, observed=True)[SUM_COLS].sum().reset_index()
+
+
+def bench_streaming_group_sums(portfolio, workdir):
+    path = os.path.join(workdir, "portfolio.parquet")
+    if not os.path.exists(path):
+        portfolio.to_parquet(path, index=False)
+    schema = {**{col: "float64" for col in SUM_COLS}, "Segment": "category", "Stage": "category"}
+    return lambda: group_aggregation.streaming_group_sums(path, KEY_COLS, SUM_COLS, schema=schema)
+
+
+def bench_calculate_statistics(portfolio, workdir):
+    # The exact statistics shown by calculate_statistics, without the
+    # Streamlit output, at any size (the app streams beyond EXACT_MAX_ROWS)
+    df = portfolio.drop(columns=["Loan ID"])
+    return lambda: profiling.exact_statistics(df)
+
+
+def bench_streaming_profile(portfolio, workdir):
+    df = portfolio.drop(columns=["Loan ID"])
+    return lambda: profiling.profile_chunks(profiling.iter_frame(df))
+
+
+BENCHMARKS = {
+    "calculate_provisions": bench_calculate_provisions,
+    "group_sums": bench_group_sums,
+    "streaming_group_sums": bench_streaming_group_sums,
+    "calculate_statistics": bench_calculate_statistics,
+    "streaming_profile": bench_streaming_profile,
+}
+
+
+# Best wall time of repeat runs, then peak traced memory of one more run
+def measure(call, repeat):
+    seconds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        call()
+        seconds.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    try:
+        call()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return min(seconds), peak / (1024 * 1024)
+
+
+def run_benchmarks(sizes, names, repeat=3, seed=DEFAULT_SEED):
+    results = []
+    with tempfile.TemporaryDirectory() as root:
+        for rows in sizes:
+            portfolio = synthetic_portfolio(rows, seed)
+            workdir = os.path.join(root, str(rows))
+            os.makedirs(workdir)
+            for name in names:
+                seconds, peak_mb = measure(BENCHMARKS[name](portfolio, workdir), repeat)
+                results.append({
+                    "benchmark": name,
+                    "rows": rows,
+                    "seconds": round(seconds, 6),
+                    "rows_per_second": round(rows / seconds) if seconds else None,
+                    "peak_mb": round(peak_mb, 2),
+                })
+                print(f"{name:<24} {rows:>12,} rows  {seconds:10.4f} s  {peak_mb:10.1f} MB", file=sys.stderr)
+            del portfolio
+    return {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "seed": seed,
+        "repeat": repeat,
+        "environment": {
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+        },
+        "results": results,
+    }
+
+
+# Side-by-side table of two result files. A benchmark regresses when its time
+# or peak memory grew by more than threshold (relative) and by more than the
+# noise floor (MIN_SECONDS / MIN_MB).
+def compare_results(baseline, current, threshold=0.1):
+    columns = ["benchmark", "rows", "seconds", "peak_mb"]
+    base = pd.DataFrame(baseline["results"], columns=columns)
+    new = pd.DataFrame(current["results"], columns=columns)
+    table = base.merge(new, on=["benchmark", "rows"], suffixes=(" base", " new"))
+    table["time ratio"] = (table["seconds new"] / table["seconds base"]).round(3)
+    table["memory ratio"] = (table["peak_mb new"] / table["peak_mb base"]).round(3)
+    slower = (table["time ratio"] > 1 + threshold) & (table["seconds new"] - table["seconds base"] > MIN_SECONDS)
+    bigger = (table["memory ratio"] > 1 + threshold) & (table["peak_mb new"] - table["peak_mb base"] > MIN_MB)
+    table["regression"] = np.select([slower & bigger, slower, bigger], ["time+memory", "time", "memory"], "")
+    return table
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the apps' hot paths on a synthetic portfolio.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the benchmarks and store the results as JSON")
+    run_parser.add_argument("--sizes", nargs="+", default=DEFAULT_SIZES, help="Portfolio sizes, e.g. 10k 1M")
+    run_parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="Benchmarks to run (default: all)")
+    run_parser.add_argument("--repeat", type=int, default=3, help="Timed runs per benchmark (the best is kept)")
+    run_parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    run_parser.add_argument("--output", default="benchmark_results.json")
+
+    compare_parser = commands.add_parser("compare", help="Compare two result files and flag regressions")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="Allowed relative slowdown (0.1 = 10%%)")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        sizes = [parse_size(size) for size in args.sizes]
+        results = run_benchmarks(sizes, args.only or list(BENCHMARKS), repeat=args.repeat, seed=args.seed)
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}", file=sys.stderr)
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    table = compare_results(baseline, current, args.threshold)
+    print(table.to_string(index=False))
+    regressions = table[table["regression"] != ""]
+    if len(regressions):
+        print(f"\n{len(regressions)} regression(s) above {args.threshold:.0%}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+
+# Default size of chart payloads
+DEFAULT_MAX_POINTS = 2000
+DEFAULT_MAX_BARS = 30
+
+
+# Shape-preserving decimation of a numeric series for a line chart: the
+# series is split into max_points / 2 equal buckets and the minimum and
+# maximum of each bucket are kept in their original order, so spikes and
+# dips survive. Missing values are dropped; the index is kept as the x axis.
+def minmax_downsample(series, max_points=DEFAULT_MAX_POINTS):
+    series = series.dropna()
+    if len(series) <= max_points:
+        return series
+
+    values = series.to_numpy(dtype=float)
+    buckets = max(1, max_points // 2)
+    size = len(values) // buckets
+    full = buckets * size
+    blocks = values[:full].reshape(buckets, size)
+    starts = np.arange(buckets) * size
+    positions = np.concatenate([
+        starts + blocks.argmin(axis=1),
+        starts + blocks.argmax(axis=1),
+    ])
+
+    # Leftover rows that do not fill a bucket form one last bucket
+    if full < len(values):
+        tail = values[full:]
+        positions = np.concatenate([positions, [full + tail.argmin(), full + tail.argmax()]])
+
+    return series.iloc[np.unique(positions)]
+
+
+# Bar chart counts capped at the max_bars - 1 most frequent values plus one
+# "Other" bar for the rest
+def top_counts(counts, max_bars=DEFAULT_MAX_BARS):
+    if len(counts) <= max_bars:
+        return counts
+    counts = counts.sort_values(ascending=False)
+    top = counts.iloc[:max_bars - 1]
+    top.index = top.index.astype(object)
+    return pd.concat([top, pd.Series({"Other": counts.iloc[max_bars - 1:].sum()})])
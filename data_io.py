@@ -0,0 +1,181 @@
+import io
+import os
+import tempfile
+from contextlib import contextmanager
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+# File types accepted by the apps' uploaders
+UPLOAD_TYPES = ["csv", "parquet", "pq", "feather", "arrow", "ipc"]
+
+PARQUET_EXTENSIONS = (".parquet", ".pq")
+FEATHER_EXTENSIONS = (".feather", ".arrow", ".ipc")
+
+
+# File format from the name of a path or an uploaded file
+def file_format(source):
+    name = os.fspath(source) if isinstance(source, (str, os.PathLike)) else getattr(source, "name", "")
+    extension = os.path.splitext(name)[1].lower()
+    if extension in PARQUET_EXTENSIONS:
+        return "parquet"
+    if extension in FEATHER_EXTENSIONS:
+        return "feather"
+    return "csv"
+
+
+# Arrow input for a path (memory-mapped) or an uploaded file (wrapping its
+# buffer without a copy)
+def _arrow_source(source):
+    if isinstance(source, (str, os.PathLike)):
+        return pa.memory_map(os.fspath(source), "r")
+    if hasattr(source, "getbuffer"):
+        return pa.BufferReader(pa.py_buffer(source.getbuffer()))
+    source.seek(0)
+    return pa.BufferReader(source.read())
+
+
+# Column names of a file without reading its data
+def read_columns(source):
+    kind = file_format(source)
+    if kind == "parquet":
+        return pq.read_schema(_arrow_source(source)).names
+    if kind == "feather":
+        return pa.ipc.open_file(_arrow_source(source)).schema.names
+    if not isinstance(source, (str, os.PathLike)):
+        source.seek(0)
+    return list(pd.read_csv(source, nrows=0).columns)
+
+
+# Cast Arrow columns to the compact schema: "category" is dictionary encoded,
+# "float32"/"float64" are cast, and "date" becomes date32 when the file
+# already stores a date or timestamp (text dates are left to the caller)
+def _apply_schema(table, schema):
+    for name, kind in schema.items():
+        if name not in table.column_names:
+            continue
+        index = table.column_names.index(name)
+        column = table.column(index)
+        if kind == "category" and not pa.types.is_dictionary(column.type):
+            column = column.dictionary_encode()
+        elif kind in ("float32", "float64"):
+            column = column.cast(pa.float32() if kind == "float32" else pa.float64())
+        elif kind == "date" and (pa.types.is_timestamp(column.type) or pa.types.is_date(column.type)):
+            column = column.cast(pa.date32())
+        else:
+            continue
+        table = table.set_column(index, name, column)
+    return table
+
+
+# Convert to pandas with dates as datetime64. Dictionary columns come back in
+# order of appearance; sort their categories so groupby output keeps the same
+# order as for CSV input.
+def _to_pandas(table, schema):
+    df = table.to_pandas(date_as_object=False)
+    for name, kind in schema.items():
+        if kind == "category" and name in df.columns:
+            df[name] = df[name].cat.reorder_categories(df[name].cat.categories.sort_values())
+    return df
+
+
+# pandas dtypes for the float columns of the schema, applied while parsing a
+# CSV. Categoricals are converted after parsing so that they keep the parsed
+# type of their values (Stage 1/2/3 stays numeric).
+def _csv_dtypes(schema, columns):
+    dtypes = {
+        name: kind for name, kind in schema.items()
+        if kind in ("float32", "float64") and (columns is None or name in columns)
+    }
+    return dtypes or None
+
+
+def _csv_categories(df, schema):
+    for name, kind in schema.items():
+        if kind == "category" and name in df.columns:
+            df[name] = df[name].astype("category")
+    return df
+
+
+# Read a CSV, Parquet or Feather (Arrow IPC) file into a DataFrame. Only the
+# given columns are read, and schema maps column names to compact types
+# ("category", "float32", "float64" or "date"). Parquet and Feather files are
+# memory-mapped, so only the projected columns are touched.
+def read_table(source, columns=None, schema=None):
+    schema = schema or {}
+    kind = file_format(source)
+
+    if kind == "csv":
+        if not isinstance(source, (str, os.PathLike)):
+            source.seek(0)
+        return _csv_categories(pd.read_csv(source, usecols=columns, dtype=_csv_dtypes(schema, columns)), schema)
+
+    if kind == "parquet":
+        table = pq.read_table(_arrow_source(source), columns=columns, memory_map=True)
+    else:
+        table = feather.read_table(_arrow_source(source), columns=columns, memory_map=True)
+    return _to_pandas(_apply_schema(table, schema), schema)
+
+
+# Read a file in DataFrames of at most chunksize rows: CSV through the
+# chunked pandas reader, Parquet batch by batch, Feather from a memory map
+def iter_chunks(source, chunksize, columns=None, schema=None):
+    kind = file_format(source)
+    if kind == "csv":
+        if not isinstance(source, (str, os.PathLike)):
+            source.seek(0)
+        for chunk in pd.read_csv(source, usecols=columns, dtype=_csv_dtypes(schema or {}, columns), chunksize=chunksize):
+            yield _csv_categories(chunk, schema or {})
+        return
+
+    if kind == "parquet":
+        batches = pq.ParquetFile(_arrow_source(source)).iter_batches(batch_size=chunksize, columns=columns)
+    else:
+        table = feather.read_table(_arrow_source(source), columns=columns, memory_map=True)
+        batches = table.to_batches(max_chunksize=chunksize)
+    for batch in batches:
+        yield _to_pandas(_apply_schema(pa.Table.from_batches([batch]), schema or {}), schema or {})
+
+
+# First rows of a file, for previews
+def read_preview(source, nrows=5):
+    if file_format(source) == "csv":
+        if not isinstance(source, (str, os.PathLike)):
+            source.seek(0)
+        return pd.read_csv(source, nrows=nrows)
+    return next(iter_chunks(source, nrows), pd.DataFrame())
+
+
+# Convert an Arrow table read by other modules to pandas with the compact schema
+def table_to_frame(table, schema=None):
+    return _to_pandas(_apply_schema(table, schema or {}), schema or {})
+
+
+# Path for a source: paths are used as they are, uploads are written to a
+# temporary file (removed on exit) so worker processes can memory-map them
+@contextmanager
+def local_path(source):
+    if isinstance(source, (str, os.PathLike)):
+        yield os.fspath(source)
+        return
+    extension = os.path.splitext(getattr(source, "name", ""))[1]
+    with tempfile.NamedTemporaryFile(suffix=extension, delete=False) as temp_file:
+        temp_file.write(source.getbuffer() if hasattr(source, "getbuffer") else source.read())
+    try:
+        yield temp_file.name
+    finally:
+        os.remove(temp_file.name)
+
+
+# Reader of its own over an uploaded file, for reading it on another thread
+# while the script keeps using the upload. The bytes are shared, not copied,
+# and the file_id is kept so upload_cache does not hash the content again.
+def detached_source(source):
+    if isinstance(source, (str, os.PathLike)):
+        return source
+    detached = io.BytesIO(source.getvalue())
+    detached.name = getattr(source, "name", "")
+    detached.file_id = getattr(source, "file_id", None)
+    return detached
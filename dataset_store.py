@@ -0,0 +1,200 @@
+import json
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+
+import pyarrow as pa
+
+import data_io
+import upload_cache
+
+# Size limit of the parsed tables kept in memory; older tables spill to disk
+DEFAULT_MAX_MB = 512
+
+# Directory of the spilled tables, shared by the apps running on this machine
+DEFAULT_ROOT = os.environ.get("STRESS_TEST_DATA_DIR", os.path.join(tempfile.gettempdir(), "stress_test_datasets"))
+
+# Dataset IDs are content hashes (upload_cache.content_hash); anything else,
+# such as a path in a ?dataset= link, is rejected before it reaches the disk
+DATASET_ID = re.compile(r"[0-9a-f]{32}")
+
+
+def valid_id(dataset_id):
+    return isinstance(dataset_id, str) and DATASET_ID.fullmatch(dataset_id) is not None
+
+
+# A stored dataset that the apps can open by ID. It is a path-like to the
+# dataset's Parquet file, so data_io reads it like any local file (memory
+# mapped, with column projection), and upload_cache keys it by its ID.
+class DatasetHandle(os.PathLike):
+    def __init__(self, dataset_id, path, name):
+        self.dataset_id = dataset_id
+        self.path = path
+        self.name = name
+
+    def __fspath__(self):
+        return self.path
+
+    def __repr__(self):
+        return f"DatasetHandle({self.dataset_id!r}, {self.name!r})"
+
+
+# Write a file through a temporary file in the same directory, so readers in
+# other processes never see a partial file
+def _write_atomic(path, write):
+    directory = os.path.dirname(path)
+    with tempfile.NamedTemporaryFile(dir=directory, suffix=".tmp", delete=False) as temp_file:
+        temp_path = temp_file.name
+    try:
+        write(temp_path)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def _write_parquet(df, path):
+    try:
+        df.to_parquet(path, index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Object columns of mixed Python types are stored as text
+        mixed = df.select_dtypes(include="object").columns
+        df.astype({col: str for col in mixed}).to_parquet(path, index=False)
+
+
+# Content-addressed dataset store. Uploads are keyed by the hash of their
+# content, so the same file uploaded again (or on every rerun) is parsed and
+# stored once. Parsed tables are kept in a size-bounded LRU; the least
+# recently used ones are spilled to <root>/<id>.parquet (with <id>.json
+# metadata) and read back from there when opened again.
+class DatasetStore:
+    def __init__(self, root=DEFAULT_ROOT, max_mb=DEFAULT_MAX_MB):
+        self.root = root
+        self.max_bytes = max_mb * 1024 * 1024
+        self.tables = OrderedDict()  # dataset ID -> (DataFrame, size)
+        self.metadata = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.disk_reads = 0
+        self.spills = 0
+        self.lock = threading.RLock()
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, dataset_id, extension=".parquet"):
+        if not valid_id(dataset_id):
+            raise KeyError(f"Invalid dataset ID: {dataset_id!r}")
+        return os.path.join(self.root, dataset_id + extension)
+
+    def _on_disk(self, dataset_id):
+        return os.path.exists(self._path(dataset_id))
+
+    # Write a dataset to disk once; its content never changes under its ID
+    def _persist(self, dataset_id):
+        if self._on_disk(dataset_id):
+            return
+        df = self.tables[dataset_id][0]
+        _write_atomic(self._path(dataset_id), lambda path: _write_parquet(df, path))
+        _write_atomic(self._path(dataset_id, ".json"), lambda path: self._write_metadata(dataset_id, path))
+        self.spills += 1
+
+    def _write_metadata(self, dataset_id, path):
+        with open(path, "w") as f:
+            json.dump(self.metadata[dataset_id], f)
+
+    def _remember(self, dataset_id, df):
+        size = upload_cache.estimate_size(df)
+        self.tables[dataset_id] = (df, size)
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes and len(self.tables) > 1:
+            evicted_id = next(iter(self.tables))
+            self._persist(evicted_id)
+            self.total_bytes -= self.tables.pop(evicted_id)[1]
+
+    # Parse and store an uploaded file unless its content is already stored;
+    # returns the dataset ID
+    def add(self, uploaded_file):
+        dataset_id = upload_cache.content_hash(uploaded_file)
+        with self.lock:
+            if dataset_id in self.tables or self._on_disk(dataset_id):
+                return dataset_id
+
+        df = data_io.read_table(uploaded_file)
+
+        with self.lock:
+            if dataset_id not in self.tables and not self._on_disk(dataset_id):
+                self.metadata[dataset_id] = {
+                    "Name": getattr(uploaded_file, "name", dataset_id),
+                    "Rows": len(df),
+                    "Columns": len(df.columns),
+                }
+                self._remember(dataset_id, df)
+        return dataset_id
+
+    def __contains__(self, dataset_id):
+        if not valid_id(dataset_id):
+            return False
+        with self.lock:
+            return dataset_id in self.tables or self._on_disk(dataset_id)
+
+    # Parsed table of a dataset, from memory or read back from disk. The table
+    # is shared: callers must copy it before modifying it.
+    def open(self, dataset_id, columns=None):
+        with self.lock:
+            if dataset_id in self.tables:
+                self.tables.move_to_end(dataset_id)
+                self.hits += 1
+                df = self.tables[dataset_id][0]
+                return df if columns is None else df[columns]
+            if not self._on_disk(dataset_id):
+                raise KeyError(f"Unknown dataset: {dataset_id}")
+
+        df = data_io.read_table(self._path(dataset_id), columns=columns)
+        with self.lock:
+            self.disk_reads += 1
+            if columns is None and dataset_id not in self.tables:
+                self.metadata.setdefault(dataset_id, self.info(dataset_id))
+                self._remember(dataset_id, df)
+        return df
+
+    # Handle that other apps open by ID; the dataset is written to disk first
+    def handle(self, dataset_id):
+        with self.lock:
+            if dataset_id in self.tables:
+                self._persist(dataset_id)
+            elif not self._on_disk(dataset_id):
+                raise KeyError(f"Unknown dataset: {dataset_id}")
+        return DatasetHandle(dataset_id, self._path(dataset_id), self.info(dataset_id)["Name"])
+
+    def info(self, dataset_id):
+        with self.lock:
+            if dataset_id in self.metadata:
+                info = dict(self.metadata[dataset_id])
+            else:
+                with open(self._path(dataset_id, ".json")) as f:
+                    info = json.load(f)
+            info["In Memory"] = dataset_id in self.tables
+            info["On Disk"] = self._on_disk(dataset_id)
+            return info
+
+    def stats(self):
+        with self.lock:
+            return {
+                "Datasets in Memory": len(self.tables),
+                "Memory (MB)": round(self.total_bytes / (1024 * 1024), 1),
+                "Memory Hits": self.hits,
+                "Disk Reads": self.disk_reads,
+                "Spills": self.spills,
+            }
+
+
+# Module-level store shared by the sessions of this server process
+store = DatasetStore()
+
+
+# Handle of a dataset by ID, or None when the ID is invalid or unknown
+def open_handle(dataset_id):
+    if not valid_id(dataset_id) or dataset_id not in store:
+        return None
+    return store.handle(dataset_id)
@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import data_io
+import job_runner
+
+
+# Group sums of one chunk, indexed by the group keys
+def partial_group_sums(chunk, key_cols, sum_cols):
+    return chunk.groupby(key_cols, observed=True)[sum_cols].sum()
+
+
+# Merge partial group sums; the result has one row per group seen so far
+def merge_group_sums(total, partial):
+    if total is None:
+        return partial
+    merged = pd.concat([total, partial])
+    return merged.groupby(level=list(range(merged.index.nlevels)), observed=True).sum()
+
+
+# Worker: read some Parquet row groups or Feather record batches from a
+# memory-mapped file and return their group sums
+def _unit_group_sums(path, kind, units, key_cols, sum_cols, schema):
+    columns = list(dict.fromkeys(key_cols + sum_cols))
+    if kind == "parquet":
+        table = pq.ParquetFile(path, memory_map=True).read_row_groups(list(units), columns=columns)
+    else:
+        reader = pa.ipc.open_file(pa.memory_map(path, "r"))
+        table = pa.Table.from_batches([reader.get_batch(i) for i in units], schema=reader.schema).select(columns)
+    return partial_group_sums(data_io.table_to_frame(table, schema), key_cols, sum_cols)
+
+
+# Number of independently readable units (row groups or record batches)
+def _unit_count(path, kind):
+    if kind == "parquet":
+        return pq.ParquetFile(path, memory_map=True).num_row_groups
+    return pa.ipc.open_file(pa.memory_map(path, "r")).num_record_batches
+
+
+# Segment x Stage (or any key) sums of a file without loading it whole.
+# The file is read in chunks and only the per-group partial sums are kept,
+# so memory depends on the number of groups, not rows. With workers > 1,
+# Parquet row groups / Feather record batches are aggregated in a process
+# pool from the job runner's process budget; CSV is always read in one process. The result has the same layout
+# as the in-memory groupby: key columns then sum columns, sorted by key.
+# progress(done, total) is called after each chunk with rows read (total
+# unknown), or in parallel mode with units aggregated out of all units.
+def streaming_group_sums(source, key_cols, sum_cols, chunksize=1_000_000, workers=1, schema=None, progress=None):
+    columns = list(dict.fromkeys(key_cols + sum_cols))
+    kind = data_io.file_format(source)
+    total = None
+
+    if workers > 1 and kind in ("parquet", "feather"):
+        with data_io.local_path(source) as path:
+            units = np.arange(_unit_count(path, kind))
+            parts = [part for part in np.array_split(units, min(len(units), workers * 4)) if len(part)]
+            with job_runner.runner.process_pool(workers) as pool:
+                futures = [pool.submit(_unit_group_sums, path, kind, part, key_cols, sum_cols, schema) for part in parts]
+                units_done = 0
+                for part, future in zip(parts, futures):
+                    total = merge_group_sums(total, future.result())
+                    units_done += len(part)
+                    if progress is not None:
+                        progress(units_done, len(units))
+    else:
+        rows = 0
+        for chunk in data_io.iter_chunks(source, chunksize, columns=columns, schema=schema):
+            total = merge_group_sums(total, partial_group_sums(chunk, key_cols, sum_cols))
+            rows += len(chunk)
+            if progress is not None:
+                progress(rows)
+
+    if total is None:
+        return pd.DataFrame(columns=columns)
+    return total.sort_index().reset_index()
@@ -1,46 +1,228 @@
+import os
+
 import streamlit as st
 import pandas as pd
+import numpy as np
+
+import data_io
+import dataset_store
+import group_aggregation
+import instrumentation
+import job_runner
+import upload_cache
+
+
+# Segment x Stage sums of EAD and the three scenario ECLs, cached per upload
+# and column selection: the loan-level data is only read and grouped when
+# the file or the selected columns change, not when the weights change.
+# With streaming, the file is aggregated chunk by chunk (optionally in
+# parallel workers) instead of being loaded whole. progress(done, total) is
+# called as the data is read.
+def group_sums(uploaded_file, segment_col, stage_col, ead_col, ecl_cols, streaming=False, workers=1, progress=None):
+    sum_cols = [ead_col] + ecl_cols
+    key_cols = [segment_col, stage_col]
+
+    # Read only the selected columns, with Segment/Stage as categoricals
+    schema = {col: "float64" for col in sum_cols}
+    schema.update({segment_col: "category", stage_col: "category"})
+
+    def compute():
+        if streaming:
+            return group_aggregation.streaming_group_sums(uploaded_file, key_cols, sum_cols, workers=workers, schema=schema, progress=progress)
+
+        selected_cols = list(dict.fromkeys(key_cols + sum_cols))
+        with instrumentation.stage("read columns"):
+            df = data_io.read_table(uploaded_file, columns=selected_cols, schema=schema)
+            instrumentation.set_rows(len(df))
+        if progress is not None:
+            progress(len(df))
+
+        # Group by Segment and Stage columns
+        with instrumentation.stage("groupby", rows=len(df)):
+            return df.groupby(key_cols, observed=True)[sum_cols].sum().reset_index()
+
+    key = ("group_sums", upload_cache.content_hash(uploaded_file), segment_col, stage_col, tuple(sum_cols))
+    return upload_cache.cache.get_or_compute(key, compute)
+
+
+# group_sums as a background job, so reading a large file does not block the
+# session. The job ID is kept in the session per upload and column selection:
+# reruns (such as weight changes) pick up the same job, and a new selection
+# discards the previous job (cancelling it if it still runs).
+def group_sums_job(uploaded_file, segment_col, stage_col, ead_col, ecl_cols, streaming=False, workers=1):
+    job_key = (upload_cache.content_hash(uploaded_file), segment_col, stage_col, ead_col, tuple(ecl_cols), streaming, workers)
+    current = st.session_state.get("group_sums_job")
+    if current is not None:
+        current_key, current_id = current
+        job = job_runner.runner.get(current_id)
+        if current_key == job_key and job is not None:
+            return job
+        job_runner.runner.discard(current_id)
+
+    source = data_io.detached_source(uploaded_file)
+    job_id = job_runner.runner.submit(
+        job_runner.session_id(), "Segment x Stage sums",
+        lambda job: group_sums(source, segment_col, stage_col, ead_col, ecl_cols, streaming=streaming, workers=workers, progress=job.report)
+    )
+    st.session_state.group_sums_job = (job_key, job_id)
+    return job_runner.runner.wait(job_id, timeout=job_runner.QUICK_JOB_SECONDS)
+
+
+# Total ECL per group: the weighted ECL is linear in the group sums, so it
+# is a matrix-vector product on the small aggregated table
+def weighted_ecl(grouped_data, ecl_cols, weights):
+    return grouped_data[ecl_cols].to_numpy(dtype=float) @ np.asarray(weights, dtype=float) / 100
+
+
+# Default scenario weights (in %) for each run condition
+RUN_CONDITION_WEIGHTS = {
+    "Normal": {"Baseline": 40, "Upturn": 30, "Downturn": 30},
+    "Medium": {"Baseline": 40, "Upturn": 25, "Downturn": 35},
+    "Severe": {"Baseline": 40, "Upturn": 10, "Downturn": 50},
+}
+SCENARIO_NAMES = ["Baseline", "Upturn", "Downturn"]
+
+
+# All weight vectors (in %) on a grid of the given step that sum to 100
+def weight_grid(step):
+    values = np.arange(0, 101, step)
+    baseline, upturn = np.meshgrid(values, values, indexing="ij")
+    downturn = 100 - baseline - upturn
+    valid = downturn >= 0
+    grid = pd.DataFrame({"Baseline": baseline[valid], "Upturn": upturn[valid], "Downturn": downturn[valid]})
+    grid.insert(0, "Scenario", [f"Grid {i + 1}" for i in range(len(grid))])
+    return grid
+
+
+# Scenario table of the built-in run conditions followed by the user's grid
+def scenario_table(grid=None):
+    scenarios = pd.DataFrame([{"Scenario": name, **weights} for name, weights in RUN_CONDITION_WEIGHTS.items()])
+    if grid is not None and len(grid):
+        grid = grid.copy()
+        if "Scenario" not in grid.columns:
+            grid.insert(0, "Scenario", [f"Grid {i + 1}" for i in range(len(grid))])
+        scenarios = pd.concat([scenarios, grid[["Scenario"] + SCENARIO_NAMES]], ignore_index=True)
+    return scenarios
+
+
+# Total ECL of every group under every scenario in one matrix multiply:
+# (groups x 3 ECL sums) @ (3 x scenarios weights) / 100
+def batch_weighted_ecl(grouped_data, ecl_cols, scenarios):
+    weights = scenarios[SCENARIO_NAMES].to_numpy(dtype=float).T
+    return grouped_data[ecl_cols].to_numpy(dtype=float) @ weights / 100
+
+
+# Streamlit section comparing all scenarios on the cached group sums
+def show_scenario_batch(grouped_data, segment_col, stage_col, ecl_cols):
+    st.write("### Batch Scenario Comparison")
+    step = st.number_input("Weight grid step (%)", min_value=0, max_value=100, value=10,
+                           help="0 disables the generated grid.")
+    grid_file = st.file_uploader("Optional: upload a weight grid (Baseline, Upturn, Downturn columns)",
+                                 type=data_io.UPLOAD_TYPES, key="weight_grid")
+
+    grids = []
+    if step > 0:
+        grids.append(weight_grid(int(step)))
+    if grid_file is not None:
+        grid = upload_cache.read_table(grid_file)
+        missing = [name for name in SCENARIO_NAMES if name not in grid.columns]
+        if missing:
+            st.error(f"The weight grid is missing the columns: {', '.join(missing)}")
+        else:
+            # Uploaded rows without a name are called "Upload 1..n", also
+            # when the grid is combined with the generated one
+            names = pd.Series([f"Upload {i + 1}" for i in range(len(grid))], index=grid.index)
+            grid = grid.copy()
+            grid["Scenario"] = grid["Scenario"].fillna(names).astype(str) if "Scenario" in grid.columns else names
+            grids.append(grid)
+    scenarios = scenario_table(pd.concat(grids, ignore_index=True) if grids else None)
+
+    ecl_matrix = batch_weighted_ecl(grouped_data, ecl_cols, scenarios)
+    groups = grouped_data[[segment_col, stage_col]]
+
+    # Portfolio Total ECL per scenario
+    comparison = scenarios.copy()
+    comparison["Total ECL"] = ecl_matrix.sum(axis=0)
+    st.write(f"Total ECL for {len(scenarios)} scenarios:")
+    st.dataframe(comparison)
+
+    # Sensitivity range of each Segment x Stage across the scenarios
+    sensitivity = groups.copy()
+    sensitivity["Min Total ECL"] = ecl_matrix.min(axis=1)
+    sensitivity["Max Total ECL"] = ecl_matrix.max(axis=1)
+    sensitivity["Range"] = sensitivity["Max Total ECL"] - sensitivity["Min Total ECL"]
+    for i, name in enumerate(RUN_CONDITION_WEIGHTS):
+        sensitivity[name] = ecl_matrix[:, i]
+    st.write("Sensitivity by Segment and Stage:")
+    st.dataframe(sensitivity)
+    st.bar_chart(comparison.set_index("Scenario")["Total ECL"].head(len(RUN_CONDITION_WEIGHTS)))
+
+    # Long format Segment x Stage x scenario results for download
+    long_results = pd.DataFrame({
+        segment_col: np.repeat(groups[segment_col].to_numpy(), len(scenarios)),
+        stage_col: np.repeat(groups[stage_col].to_numpy(), len(scenarios)),
+        "Scenario": np.tile(scenarios["Scenario"].to_numpy(), len(groups)),
+        "Total ECL": ecl_matrix.ravel(),
+    })
+    st.download_button(
+        label="Download Scenario Results",
+        data=long_results.to_csv(index=False),
+        file_name="scenario_results.csv",
+        mime="text/csv"
+    )
+
+
+# Stage timings of this session (off unless switched on in the sidebar)
+recorder = instrumentation.session_recorder("group_sum")
 
 # File uploader
 st.title("CSV Data Analysis App")
-uploaded_file = st.file_uploader("Choose a CSV file", type=['csv'])
+uploaded_file = st.file_uploader("Choose a CSV, Parquet or Feather file", type=data_io.UPLOAD_TYPES)
+
+# A dataset passed by the Stress Test Dashboard (?dataset=<ID>) is opened from
+# the dataset store instead of being uploaded and parsed again
+if uploaded_file is None and st.query_params.get("dataset"):
+    try:
+        uploaded_file = dataset_store.open_handle(st.query_params["dataset"])
+    except (KeyError, OSError, ValueError):
+        # Removed meanwhile, or stored without its metadata
+        uploaded_file = None
+    if uploaded_file is None:
+        st.error(f"Dataset {st.query_params['dataset']} was not found; please upload the file.")
+    else:
+        st.info(f"Using dataset {uploaded_file.name} from the Stress Test Dashboard.")
 
 # Check if file is uploaded
 if uploaded_file is not None:
-    # Read CSV file
-    df = pd.read_csv(uploaded_file)
+    # Read only the column names; the data is read once the columns are selected
+    columns = data_io.read_columns(uploaded_file)
 
     # Display column names
-    st.write("Available Columns:", list(df.columns))
+    st.write("Available Columns:", columns)
 
     # Stress Test Name (ST1)
     stress_test_name = st.text_input("Enter Stress Test Name (e.g., ST1)")
 
     if stress_test_name == "ST1":
         # Select Segment and Stage columns
-        segment_col = st.selectbox("Select Segment column", options=df.columns)
-        stage_col = st.selectbox("Select Stage column", options=df.columns)
+        segment_col = st.selectbox("Select Segment column", options=columns)
+        stage_col = st.selectbox("Select Stage column", options=columns)
 
         # Select EAD, ECL baseline, ECL upturn, and ECL downturn columns
-        ead_col = st.selectbox("Select EAD column", options=df.columns)
-        ecl_baseline_col = st.selectbox("Select ECL Baseline column", options=df.columns)
-        ecl_upturn_col = st.selectbox("Select ECL Upturn column", options=df.columns)
-        ecl_downturn_col = st.selectbox("Select ECL Downturn column", options=df.columns)
+        ead_col = st.selectbox("Select EAD column", options=columns)
+        ecl_baseline_col = st.selectbox("Select ECL Baseline column", options=columns)
+        ecl_upturn_col = st.selectbox("Select ECL Upturn column", options=columns)
+        ecl_downturn_col = st.selectbox("Select ECL Downturn column", options=columns)
 
         # Select run condition (Normal, Medium, Severe)
         run_condition = st.selectbox(
             "Select Run Condition",
-            options=["Normal", "Medium", "Severe"],
+            options=list(RUN_CONDITION_WEIGHTS),
             help="Choose the stress testing scenario."
         )
 
         # Define default weights based on the run condition
-        if run_condition == "Normal":
-            weights = {"Baseline": 40, "Upturn": 30, "Downturn": 30}
-        elif run_condition == "Medium":
-            weights = {"Baseline": 40, "Upturn": 25, "Downturn": 35}
-        elif run_condition == "Severe":
-            weights = {"Baseline": 40, "Upturn": 10, "Downturn": 50}
+        weights = dict(RUN_CONDITION_WEIGHTS[run_condition])
 
         # Display default weights
         st.write(f"Default Weights for {run_condition}:")
@@ -53,33 +235,57 @@ if uploaded_file is not None:
             weights["Upturn"] = st.number_input("Upturn Weight", min_value=0, max_value=100, value=weights["Upturn"])
             weights["Downturn"] = st.number_input("Downturn Weight", min_value=0, max_value=100, value=weights["Downturn"])
 
+        # Large files can be aggregated chunk by chunk instead of loaded whole
+        streaming = st.checkbox("Stream the file in chunks (large files)")
+        workers = 1
+        if streaming:
+            workers = st.number_input("Worker processes (Parquet/Feather)", min_value=1, max_value=os.cpu_count() or 1, value=1)
+
         # Process and display results after grouping
         if segment_col and stage_col and ead_col and ecl_baseline_col and ecl_upturn_col and ecl_downturn_col:
             try:
-                # Group by Segment and Stage columns
-                grouped_data = df.groupby([segment_col, stage_col])[[ead_col, ecl_baseline_col, ecl_upturn_col, ecl_downturn_col]].sum().reset_index()
-
-                # Calculate total ECL per group
-                grouped_data['Total ECL'] = (
-                    (grouped_data[ecl_baseline_col] * weights["Baseline"] / 100) +
-                    (grouped_data[ecl_upturn_col] * weights["Upturn"] / 100) +
-                    (grouped_data[ecl_downturn_col] * weights["Downturn"] / 100)
-                )
-
-                # Display results
-                st.write("Grouped and Aggregated Data:")
-                st.dataframe(grouped_data)
-
-                # Calculate and display totals
-                st.write("Totals:")
-                totals = grouped_data[['Total ECL']].sum()
-                total_df = pd.DataFrame(totals).T
-                total_df.index = ['Total']
-                st.dataframe(total_df)
-
-                # Optional: Display grand total
-                grand_total = totals.sum()
-                st.write(f"Grand Total (sum of Total ECL): {grand_total}")
+                # Group sums run as a background job (cached per upload and
+                # columns); copy the result before adding the Total ECL column
+                ecl_cols = [ecl_baseline_col, ecl_upturn_col, ecl_downturn_col]
+                job = group_sums_job(uploaded_file, segment_col, stage_col, ead_col, ecl_cols, streaming=streaming, workers=int(workers))
+                job_runner.show_job_progress(job)
+                if job.status == "failed":
+                    raise job.error
+                if job.status == "cancelled":
+                    st.warning("The aggregation was cancelled.")
+                    # Without the cancelled job the rerun submits a new one
+                    if st.button("Run again"):
+                        job_runner.runner.discard(job.job_id)
+                        st.rerun()
+
+                if job.status == "done":
+                    grouped_data = job.result.copy()
+
+                    # Calculate total ECL per group
+                    with instrumentation.stage("weighted ECL", rows=len(grouped_data)):
+                        grouped_data['Total ECL'] = weighted_ecl(
+                            grouped_data, ecl_cols, [weights["Baseline"], weights["Upturn"], weights["Downturn"]]
+                        )
+
+                    # Display results
+                    st.write("Grouped and Aggregated Data:")
+                    st.dataframe(grouped_data)
+
+                    # Calculate and display totals
+                    st.write("Totals:")
+                    totals = grouped_data[['Total ECL']].sum()
+                    total_df = pd.DataFrame(totals).T
+                    total_df.index = ['Total']
+                    st.dataframe(total_df)
+
+                    # Optional: Display grand total
+                    grand_total = totals.sum()
+                    st.write(f"Grand Total (sum of Total ECL): {grand_total}")
+
+                    # Optional: every run condition plus a grid of weights at once
+                    if st.checkbox("Compare all scenarios"):
+                        with instrumentation.stage("scenario comparison", rows=len(grouped_data)):
+                            show_scenario_batch(grouped_data, segment_col, stage_col, ecl_cols)
 
             except Exception as e:
                 st.error(f"An error occurred: {str(e)}")
@@ -89,3 +295,6 @@ if uploaded_file is not None:
 # Add some basic information
 st.sidebar.title("About")
 st.sidebar.info("This app allows you to upload a CSV file, perform grouping and aggregation operations on the data, and calculate ECL under different stress test scenarios.")
+instrumentation.show_sidebar_panel(recorder)
+st.sidebar.write("Upload Cache:", upload_cache.cache.stats())
+st.sidebar.write("Background Jobs:", job_runner.runner.stats())
@@ -0,0 +1,186 @@
+import contextvars
+import json
+import logging
+import os
+import time
+from collections import deque
+
+# Stage records are also appended as JSON lines to this file when it is set
+LOG_PATH = os.environ.get("INSTRUMENTATION_LOG")
+
+# Recording is on by default when INSTRUMENTATION=1
+ENABLED_BY_DEFAULT = os.environ.get("INSTRUMENTATION", "0") == "1"
+
+DEFAULT_MAX_RECORDS = 1000
+
+logger = logging.getLogger("instrumentation")
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+# Resident memory of this process in bytes, or None where /proc is missing
+def _rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+# Stages open in the current context, innermost last. Background jobs run in
+# their own copy of the context, so they and the script thread each nest
+# their stages on their own stack.
+_stack = contextvars.ContextVar("instrumentation_stack", default=())
+
+
+# A named stage being timed. Nested stages are named "outer/inner".
+class _Stage:
+    def __init__(self, recorder, name, rows):
+        self.recorder = recorder
+        self.name = name
+        self.rows = rows
+
+    def __enter__(self):
+        stack = _stack.get()
+        if stack:
+            self.name = f"{stack[-1].name}/{self.name}"
+        self.token = _stack.set(stack + (self,))
+        self.memory = _rss_bytes()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.started
+        memory = _rss_bytes()
+        _stack.reset(self.token)
+        self.recorder.add({
+            "app": self.recorder.app,
+            "run": self.recorder.run,
+            "stage": self.name,
+            "seconds": round(seconds, 6),
+            "rows": self.rows,
+            "rows_per_second": round(self.rows / seconds) if self.rows and seconds > 0 else None,
+            "memory_delta_mb": round((memory - self.memory) / (1024 * 1024), 2) if memory is not None and self.memory is not None else None,
+            "failed": exc_info[0] is not None,
+        })
+        return False
+
+
+# Stage used while recording is off: entering and leaving it does nothing
+class _NullStage:
+    rows = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+# Stage records of one app session, newest last. Each rerun of the app is a
+# new run number, so the panel can show the stages of the latest run.
+class Recorder:
+    def __init__(self, app, enabled=ENABLED_BY_DEFAULT, max_records=DEFAULT_MAX_RECORDS, log_path=LOG_PATH):
+        self.app = app
+        self.enabled = enabled
+        self.records = deque(maxlen=max_records)
+        self.log_path = log_path
+        self.run = 0
+
+    def start_run(self):
+        self.run += 1
+
+    def stage(self, name, rows=None):
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name, rows)
+
+    def add(self, record):
+        self.records.append(record)
+        line = json.dumps(record)
+        logger.debug(line)
+        if self.log_path:
+            with open(self.log_path, "a") as f:
+                f.write(line + "\n")
+
+    def last_run(self):
+        return [record for record in self.records if record["run"] == self.run]
+
+    def to_json(self):
+        return json.dumps(list(self.records), indent=2)
+
+
+# Recorder of the current session, so library code can record stages without
+# being passed one; None (the default) records nothing
+_current = contextvars.ContextVar("instrumentation_recorder", default=None)
+
+
+def set_recorder(recorder):
+    _current.set(recorder)
+
+
+# Time a named stage with the current recorder:
+#     with instrumentation.stage("parse dates", rows=len(df)):
+#         ...
+# When recording is off this returns a shared no-op stage.
+def stage(name, rows=None):
+    recorder = _current.get()
+    if recorder is None or not recorder.enabled:
+        return _NULL_STAGE
+    return _Stage(recorder, name, rows)
+
+
+# Recorder of the current session (a disabled one when there is none), for
+# work that runs later on another thread, such as a deferred download
+def current_recorder():
+    return _current.get() or Recorder(None, enabled=False)
+
+
+# Set the row count of the innermost running stage of the current context
+# (when it is only known once the stage has read its input)
+def set_rows(rows):
+    stack = _stack.get()
+    if stack:
+        stack[-1].rows = rows
+
+
+# Recorder for a Streamlit app, kept in the session so it survives reruns,
+# with a sidebar switch to turn recording on. Call once at the top of the app.
+def session_recorder(app):
+    import streamlit as st
+
+    key = f"instrumentation_{app}"
+    if key not in st.session_state:
+        st.session_state[key] = Recorder(app)
+    recorder = st.session_state[key]
+    recorder.enabled = st.sidebar.checkbox("Record stage timings", value=recorder.enabled, key=f"{key}_enabled")
+    recorder.start_run()
+    set_recorder(recorder)
+    return recorder
+
+
+# Collapsible sidebar panel with the stages of the latest run and a JSON
+# export of all recorded stages. Call at the end of the app.
+def show_sidebar_panel(recorder):
+    import streamlit as st
+
+    if not recorder.enabled:
+        return
+    with st.sidebar.expander("Stage Timings", expanded=False):
+        stages = recorder.last_run()
+        if stages:
+            st.dataframe(
+                [{key: record[key] for key in ("stage", "seconds", "rows", "rows_per_second", "memory_delta_mb")} for record in stages],
+                hide_index=True,
+            )
+        else:
+            st.write("No stages recorded in this run.")
+        st.download_button(
+            label="Download timings (JSON)",
+            data=recorder.to_json(),
+            file_name=f"{recorder.app}_timings.json",
+            mime="application/json",
+        )
@@ -0,0 +1,305 @@
+import contextvars
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import upload_cache
+
+# Worker threads shared by all sessions of the server process
+DEFAULT_WORKERS = max(2, min(8, os.cpu_count() or 1))
+
+# Jobs of one session that may run at the same time; its other jobs wait, so
+# one user cannot take every worker
+DEFAULT_MAX_RUNNING_PER_SESSION = 1
+
+# Finished jobs kept for their results, and the memory their results may
+# take together; the oldest ones beyond either limit are discarded
+DEFAULT_MAX_FINISHED = 100
+DEFAULT_MAX_FINISHED_MB = 512
+
+# Worker processes the process pools of all jobs may use together
+DEFAULT_MAX_PROCESSES = os.cpu_count() or 1
+
+# Refresh interval of the progress panel
+POLL_SECONDS = 1.0
+
+# Jobs finishing within this time (cached or small results) are shown at
+# once, without a progress panel
+QUICK_JOB_SECONDS = 0.5
+
+
+class JobCancelled(Exception):
+    pass
+
+
+# A unit of work run by the JobRunner. fn(job) does the work and returns the
+# result; it calls job.report(done, total) after each chunk, which records
+# the progress and raises JobCancelled once the job has been cancelled.
+class Job:
+    def __init__(self, job_id, session_id, name, fn):
+        self.job_id = job_id
+        self.session_id = session_id
+        self.name = name
+        self.fn = fn
+        self.context = contextvars.copy_context()
+        self.status = "queued"
+        self.done = 0
+        self.total = None
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished_at = None
+        self.size = 0  # estimated memory of the result once finished
+        self.discarded = False
+        self.cancel_requested = threading.Event()
+        self.cleanup = []  # called when the job is discarded
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed", "cancelled")
+
+    def report(self, done, total=None):
+        if self.cancel_requested.is_set():
+            raise JobCancelled()
+        self.done = done
+        self.total = total
+
+    # Fraction done, or None while the total is unknown
+    def progress(self):
+        if not self.total:
+            return None
+        return min(1.0, self.done / self.total)
+
+    def seconds(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started
+
+
+# Job queue with a fixed pool of worker threads shared by all sessions. Each
+# session has its own queue and the workers take jobs from the sessions in
+# turn (round robin), with at most max_running_per_session jobs of a session
+# running at once. Jobs stay available by ID across reruns until they are
+# discarded, by their session or once too many finished results are kept.
+# CPU-bound steps inside a job get a process pool from the runner, whose
+# processes come out of one budget for all jobs (see process_pool).
+class JobRunner:
+    def __init__(self, workers=DEFAULT_WORKERS, max_running_per_session=DEFAULT_MAX_RUNNING_PER_SESSION,
+                 max_finished=DEFAULT_MAX_FINISHED, max_finished_mb=DEFAULT_MAX_FINISHED_MB, max_processes=DEFAULT_MAX_PROCESSES):
+        self.workers = workers
+        self.max_running_per_session = max_running_per_session
+        self.max_finished = max_finished
+        self.max_finished_bytes = max_finished_mb * 1024 * 1024
+        self.max_processes = max_processes
+        self.processes = 0  # pool processes in use
+        self.jobs = OrderedDict()  # job ID -> Job, oldest first
+        self.queues = OrderedDict()  # session ID -> deque of queued jobs
+        self.running = Counter()
+        self.threads = []
+        self.condition = threading.Condition()
+
+    def submit(self, session_id, name, fn):
+        job = Job(uuid.uuid4().hex, session_id, name, fn)
+        with self.condition:
+            self.jobs[job.job_id] = job
+            self.queues.setdefault(session_id, deque()).append(job)
+            while len(self.threads) < self.workers:
+                thread = threading.Thread(target=self._work, name=f"job-worker-{len(self.threads)}", daemon=True)
+                thread.start()
+                self.threads.append(thread)
+            self.condition.notify()
+        return job.job_id
+
+    def get(self, job_id):
+        with self.condition:
+            return self.jobs.get(job_id)
+
+    # Wait until a job has finished or timeout seconds have passed
+    def wait(self, job_id, timeout=None):
+        with self.condition:
+            job = self.jobs.get(job_id)
+            if job is not None:
+                self.condition.wait_for(lambda: job.finished, timeout)
+            return job
+
+    # Queued jobs are cancelled at once; running jobs stop at their next report
+    def cancel(self, job_id):
+        with self.condition:
+            job = self.jobs.get(job_id)
+            if job is None or job.finished:
+                return
+            job.cancel_requested.set()
+            if job.status == "queued":
+                self.queues[job.session_id].remove(job)
+                if not self.queues[job.session_id]:
+                    del self.queues[job.session_id]
+                job.status = "cancelled"
+                job.finished_at = time.time()
+                self.condition.notify_all()
+
+    # Drop a job its session no longer needs (it started another one): the
+    # job is cancelled, and its result and cleanup go as soon as it has
+    # finished
+    def discard(self, job_id):
+        self.cancel(job_id)
+        with self.condition:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return
+            job.discarded = True
+            if job.finished:
+                self._drop(job)
+
+    # Process pool for a CPU-bound step of a job, with up to `workers`
+    # processes out of the budget of max_processes shared by all jobs. Waits
+    # until a process is free and may give fewer than asked for; the
+    # processes go back to the budget when the pool closes.
+    @contextmanager
+    def process_pool(self, workers):
+        with self.condition:
+            self.condition.wait_for(lambda: self.processes < self.max_processes)
+            granted = max(1, min(workers, self.max_processes - self.processes))
+            self.processes += granted
+        try:
+            with ProcessPoolExecutor(max_workers=granted, mp_context=process_pool_context()) as pool:
+                yield pool
+        finally:
+            with self.condition:
+                self.processes -= granted
+                self.condition.notify_all()
+
+    # Next job in round-robin order over the sessions (caller holds the lock)
+    def _next_job(self):
+        for session_id, queue in self.queues.items():
+            if self.running[session_id] < self.max_running_per_session:
+                job = queue.popleft()
+                if queue:
+                    self.queues.move_to_end(session_id)
+                else:
+                    del self.queues[session_id]
+                return job
+        return None
+
+    def _work(self):
+        while True:
+            with self.condition:
+                job = self._next_job()
+                while job is None:
+                    self.condition.wait()
+                    job = self._next_job()
+                self.running[job.session_id] += 1
+                job.status = "running"
+                job.started = time.time()
+
+            try:
+                job.result = job.context.run(job.fn, job)
+                status = "done"
+            except JobCancelled:
+                status = "cancelled"
+            except Exception as e:
+                job.error = e
+                status = "failed"
+            job.size = upload_cache.estimate_size(job.result) if job.result is not None else 0
+
+            with self.condition:
+                job.status = status
+                job.finished_at = time.time()
+                self.running[job.session_id] -= 1
+                if not self.running[job.session_id]:
+                    del self.running[job.session_id]
+                self._discard_old_jobs()
+                self.condition.notify_all()
+
+    # Drop discarded jobs once finished, then the oldest finished jobs beyond
+    # max_finished or max_finished_bytes (caller holds the lock)
+    def _discard_old_jobs(self):
+        finished = []
+        for job in list(self.jobs.values()):
+            if job.finished and job.discarded:
+                self._drop(job)
+            elif job.finished:
+                finished.append(job)
+        total_bytes = sum(job.size for job in finished)
+        for i, job in enumerate(finished):
+            if len(finished) - i <= self.max_finished and total_bytes <= self.max_finished_bytes:
+                break
+            total_bytes -= job.size
+            self._drop(job)
+
+    # Remove a finished job with its result and run its cleanup (caller
+    # holds the lock)
+    def _drop(self, job):
+        del self.jobs[job.job_id]
+        job.result = None
+        for cleanup in job.cleanup:
+            cleanup()
+
+    def stats(self):
+        with self.condition:
+            statuses = Counter(job.status for job in self.jobs.values())
+            return {
+                "Workers": self.workers,
+                "Queued": statuses["queued"],
+                "Running": statuses["running"],
+                "Finished": statuses["done"] + statuses["failed"] + statuses["cancelled"],
+                "Finished MB": round(sum(job.size for job in self.jobs.values() if job.finished) / (1024 * 1024), 1),
+                "Sessions Waiting": len(self.queues),
+                "Processes": f"{self.processes} of {self.max_processes}",
+            }
+
+
+# Start method of process pools used inside jobs. Forking while other threads
+# (the job workers, Streamlit's) hold locks can deadlock the child, so the
+# pool processes come from a fork server, or are spawned where there is none.
+# The fork server imports numpy and pandas once, so its workers start quickly.
+def process_pool_context():
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["numpy", "pandas"])
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+# Module-level runner: Streamlit imports this module once per server process,
+# so all sessions share its workers
+runner = JobRunner()
+
+
+# ID of the current Streamlit session for the runner's fair scheduling
+def session_id():
+    import streamlit as st
+
+    if "job_session_id" not in st.session_state:
+        st.session_state.job_session_id = uuid.uuid4().hex
+    return st.session_state.job_session_id
+
+
+# Progress bar and Cancel button of a queued or running job. The panel
+# refreshes itself every POLL_SECONDS and reruns the app once the job ends.
+def show_job_progress(job):
+    import streamlit as st
+
+    if job.finished:
+        return
+
+    @st.fragment(run_every=POLL_SECONDS)
+    def progress_panel():
+        if job.finished:
+            st.rerun()
+        if job.status == "queued":
+            st.info(f"{job.name}: waiting for a worker...")
+        else:
+            fraction = job.progress()
+            text = f"{job.name}: {job.done:,} of {job.total:,}" if job.total else f"{job.name}: {job.done:,} rows processed"
+            st.progress(fraction or 0.0, text=f"{text} ({job.seconds():.0f} s)")
+        if st.button("Cancel", key=f"cancel_{job.job_id}"):
+            runner.cancel(job.job_id)
+            st.rerun()
+
+    progress_panel()
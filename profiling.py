@@ -0,0 +1,293 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+# Accuracy defaults of the approximate profile
+DEFAULT_RELATIVE_ACCURACY = 0.01  # quantiles within 1% of the true value
+DEFAULT_HLL_PRECISION = 14  # 2^14 registers, about 0.8% error on distinct counts
+DEFAULT_TOP_K = 20
+
+# Inputs up to this many rows are profiled exactly
+EXACT_MAX_ROWS = 1_000_000
+
+QUANTILES = [0.25, 0.5, 0.75]
+
+
+# Mergeable mean/variance/min/max (Welford, merged with Chan et al.'s formula)
+class MomentSketch:
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, values):
+        if len(values) == 0:
+            return
+        other = MomentSketch()
+        other.count = len(values)
+        other.mean = float(values.mean())
+        other.m2 = float(((values - other.mean) ** 2).sum())
+        other.min = float(values.min())
+        other.max = float(values.max())
+        self.merge(other)
+
+    def merge(self, other):
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta ** 2 * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def std(self):
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else np.nan
+
+
+# Mergeable quantile sketch with relative accuracy (DDSketch): values are
+# counted in logarithmic buckets, so any quantile is returned within
+# relative_accuracy of the exact value
+class QuantileSketch:
+    def __init__(self, relative_accuracy=DEFAULT_RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.positive = {}
+        self.negative = {}
+        self.zeros = 0
+        self.count = 0
+
+    def _add_buckets(self, buckets, magnitudes):
+        keys, counts = np.unique(np.ceil(np.log(magnitudes) / self.log_gamma).astype(np.int64), return_counts=True)
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            buckets[key] = buckets.get(key, 0) + count
+
+    def update(self, values):
+        tiny = np.finfo(float).tiny
+        self._add_buckets(self.positive, values[values > tiny])
+        self._add_buckets(self.negative, -values[values < -tiny])
+        self.zeros += int((np.abs(values) <= tiny).sum())
+        self.count += len(values)
+
+    def merge(self, other):
+        for mine, theirs in ((self.positive, other.positive), (self.negative, other.negative)):
+            for key, count in theirs.items():
+                mine[key] = mine.get(key, 0) + count
+        self.zeros += other.zeros
+        self.count += other.count
+
+    def _value(self, key):
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def quantile(self, q):
+        if self.count == 0:
+            return np.nan
+        rank = q * (self.count - 1)
+        seen = 0
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return -self._value(key)
+        seen += self.zeros
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return self._value(key)
+        return self._value(max(self.positive)) if self.positive else 0.0
+
+
+# Number of significant bits of each uint64
+def _bit_length(values):
+    values = values.copy()
+    length = np.zeros(len(values), dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        large = values >= np.uint64(1 << shift)
+        length[large] += shift
+        values[large] >>= np.uint64(shift)
+    return length + (values > 0)
+
+
+# HyperLogLog distinct count estimate; merging keeps the register maxima
+class DistinctSketch:
+    def __init__(self, precision=DEFAULT_HLL_PRECISION):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    # Adding a value again does not change the sketch, so callers can pass
+    # only the distinct values of a chunk
+    def update(self, values):
+        if len(values) == 0:
+            return
+        hashes = pd.util.hash_pandas_object(pd.Series(values), index=False).to_numpy(dtype=np.uint64)
+        width = 64 - self.precision
+        index = (hashes >> np.uint64(width)).astype(np.int64)
+        remainder = hashes & np.uint64((1 << width) - 1)
+        rank = (width - _bit_length(remainder) + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(2.0 ** -self.registers.astype(float))
+        empty = int((self.registers == 0).sum())
+        if estimate <= 2.5 * m and empty:
+            estimate = m * math.log(m / empty)  # linear counting for small cardinalities
+        return int(round(estimate))
+
+
+# Heavy hitters (Misra-Gries): keeps at most capacity counters; counts are
+# lower bounds. Each time the counters overflow they are all decreased by the
+# same cutoff, and the sum of these cutoffs (`error`) is how much any count
+# may be too low; it is at most rows / (capacity + 1) and 0 while every
+# distinct value still has its own counter.
+class TopKSketch:
+    def __init__(self, k=DEFAULT_TOP_K, capacity=None):
+        self.k = k
+        self.capacity = capacity or 10 * k
+        self.counts = pd.Series(dtype="int64")
+        self.error = 0
+
+    def _add(self, counts):
+        counts = counts[counts > 0]
+        self.counts = counts.astype("int64") if self.counts.empty else self.counts.add(counts, fill_value=0).astype("int64")
+        if len(self.counts) > self.capacity:
+            cutoff = self.counts.nlargest(self.capacity + 1).iloc[-1]
+            self.counts = self.counts[self.counts > cutoff] - cutoff
+            self.error += int(cutoff)
+
+    def update(self, values):
+        counts = pd.Series(values).value_counts()
+        counts.index = counts.index.astype(object)
+        self._add(counts)
+
+    def merge(self, other):
+        self.error += other.error
+        self._add(other.counts)
+
+    # Most frequent values with their counts, leaving out the values whose
+    # count is within the error (they may not be among the most frequent)
+    def top(self):
+        counts = self.counts[self.counts > self.error]
+        return counts.sort_values(ascending=False, kind="stable").head(self.k)
+
+
+# One-pass profile of chunks of a table. The kind of each column (numeric,
+# categorical or date) is taken from the first chunk it appears in.
+class StreamingProfile:
+    def __init__(self, relative_accuracy=DEFAULT_RELATIVE_ACCURACY, hll_precision=DEFAULT_HLL_PRECISION, top_k=DEFAULT_TOP_K):
+        self.relative_accuracy = relative_accuracy
+        self.hll_precision = hll_precision
+        self.top_k = top_k
+        self.kinds = {}
+        self.sketches = {}
+        self.rows = 0
+
+    def _new_sketches(self, kind):
+        if kind == "numeric":
+            return {"moments": MomentSketch(), "quantiles": QuantileSketch(self.relative_accuracy)}
+        if kind == "categorical":
+            return {"distinct": DistinctSketch(self.hll_precision), "top": TopKSketch(self.top_k)}
+        return {"min": None, "max": None}
+
+    def update(self, chunk):
+        self.rows += len(chunk)
+        for col in chunk.columns:
+            series = chunk[col]
+            if col not in self.kinds:
+                self.kinds[col] = column_kind(series)
+                self.sketches[col] = self._new_sketches(self.kinds[col])
+            kind, sketches = self.kinds[col], self.sketches[col]
+
+            if kind == "numeric":
+                values = pd.to_numeric(series, errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+                values = values[~np.isnan(values)]
+                sketches["moments"].update(values)
+                sketches["quantiles"].update(values)
+            elif kind == "categorical":
+                values = series.dropna()
+                sketches["distinct"].update(pd.Series(values.unique()).astype(str).to_numpy())
+                sketches["top"].update(values)
+            elif kind == "date":
+                values = pd.to_datetime(series, errors="coerce").dropna()
+                if len(values):
+                    low, high = values.min(), values.max()
+                    sketches["min"] = low if sketches["min"] is None else min(sketches["min"], low)
+                    sketches["max"] = high if sketches["max"] is None else max(sketches["max"], high)
+        return self
+
+    def numeric_summary(self):
+        summary = {}
+        for col, kind in self.kinds.items():
+            if kind != "numeric":
+                continue
+            moments, quantiles = self.sketches[col]["moments"], self.sketches[col]["quantiles"]
+            summary[col] = {
+                "count": float(moments.count),
+                "mean": moments.mean if moments.count else np.nan,
+                "std": moments.std(),
+                "min": moments.min if moments.count else np.nan,
+                **{f"{q:.0%}": float(np.clip(quantiles.quantile(q), moments.min, moments.max)) for q in QUANTILES},
+                "max": moments.max if moments.count else np.nan,
+            }
+        return pd.DataFrame(summary)
+
+    # Per categorical column: (distinct count estimate, top values, error of
+    # the top value counts)
+    def categorical_summary(self):
+        return {
+            col: (self.sketches[col]["distinct"].estimate(), self.sketches[col]["top"].top(), self.sketches[col]["top"].error)
+            for col, kind in self.kinds.items() if kind == "categorical"
+        }
+
+    def date_ranges(self):
+        return {
+            col: (self.sketches[col]["min"], self.sketches[col]["max"])
+            for col, kind in self.kinds.items() if kind == "date"
+        }
+
+
+# Profile kind of a column, matching the groups shown by calculate_statistics
+def column_kind(series):
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return "date"
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        return "numeric"
+    return "categorical"
+
+
+# Exact statistics of an in-memory DataFrame, as shown by
+# calculate_statistics: describe() of the numeric columns (None without any),
+# value counts per object column and (min, max) per date column
+def exact_statistics(df):
+    numerical_cols = df.select_dtypes(include=[np.number]).columns
+    categorical_cols = df.select_dtypes(include=["object"]).columns
+    date_cols = df.select_dtypes(include=["datetime64[ns]"]).columns
+    return {
+        "numeric": df[numerical_cols].describe() if len(numerical_cols) > 0 else None,
+        "categorical": {col: df[col].value_counts() for col in categorical_cols},
+        "dates": {col: (df[col].min(), df[col].max()) for col in date_cols},
+    }
+
+
+# Profile an iterable of DataFrame chunks in one pass
+def profile_chunks(chunks, **accuracy):
+    profile = StreamingProfile(**accuracy)
+    for chunk in chunks:
+        profile.update(chunk)
+    return profile
+
+
+# Slices of an in-memory DataFrame, for profiling it with bounded extra memory
+def iter_frame(df, chunksize=500_000):
+    for start in range(0, len(df), chunksize):
+        yield df.iloc[start:start + chunksize]
@@ -0,0 +1,541 @@
+# Provision calculation without any UI: imported by Stage3_CRMS_Provisions.py
+# and by batch jobs, and runnable as a command-line tool:
+#
+#   python provisions.py loans.csv --crms-issue-date 31-Oct-2024 \
+#       --run-date 30-Sep-2025 --output provisions.parquet
+#
+# Only pandas and numpy are imported up front; data_io and result_export (and
+# with them pyarrow) are imported by the functions that read or write files.
+import time
+
+_IMPORT_STARTED = time.perf_counter()
+
+import argparse
+import os
+import sys
+from multiprocessing import shared_memory
+import pandas as pd
+import numpy as np
+from datetime import datetime, timedelta
+
+import instrumentation
+import job_runner
+
+IMPORT_SECONDS = time.perf_counter() - _IMPORT_STARTED
+
+# Output formats of the command-line tool
+OUTPUT_FORMATS = ["csv", "parquet", "feather"]
+
+# Output formats that can be written chunk by chunk, with their export format
+CHUNKED_FORMATS = {"csv": "CSV", "parquet": "Parquet"}
+
+# Load the CSV, Parquet or Feather file into a DataFrame
+def load_data(file_path, columns=None):
+    import data_io
+    return data_io.read_table(file_path, columns=columns, schema=INPUT_SCHEMA)
+
+# Convert string to date
+def convert_to_date(date_string):
+    return datetime.strptime(date_string, "%d-%b-%Y")
+
+# Calculate years since NPL
+def calculate_years_since_npl(classification_date, run_date):
+    return (run_date - classification_date).days / 365
+
+# Parse a column of dates once per distinct value; loan books repeat the same
+# classification dates many times, so this avoids re-parsing identical strings.
+# Dates are expected as DD-MMM-YYYY; anything else is parsed value by value
+# rather than with a format guessed from the first row (a first row in May
+# would otherwise be read as a full month name and break every other month)
+def parse_dates(values):
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    codes, uniques = pd.factorize(values)
+    uniques = pd.Series(uniques, dtype=object)
+    parsed = pd.to_datetime(uniques, format="%d-%b-%Y", errors='coerce')
+    unparsed = parsed.isna() & uniques.notna()
+    if unparsed.any():
+        parsed[unparsed] = pd.to_datetime(uniques[unparsed], format='mixed', errors='coerce')
+    return pd.Series(parsed.array.take(codes, allow_fill=True), index=values.index)
+
+# Numeric input columns of the provision calculation, in the order expected by
+# compute_provision_columns
+INPUT_COLUMNS = ['TOTAL OS', 'Collateral after H.C', 'Unsecured Portion Covered by ECF/DCF', 'Existing ECL held Q3\'24']
+
+# Compact schema of the calculation inputs for data_io: columnar files keep
+# their stored dates (as date32) so they need no parsing. Amounts stay
+# float64, float32 would round large exposures to well above a cent.
+INPUT_SCHEMA = {
+    'Classification date': 'date',
+    'TOTAL OS': 'float64',
+    'Collateral after H.C': 'float64',
+    'Unsecured Portion Covered by ECF/DCF': 'float64',
+    'Existing ECL held Q3\'24': 'float64',
+}
+
+# Parsed classification dates, with missing or unparsable dates set to a default
+def parse_classification_dates(values):
+    return parse_dates(values).fillna(pd.to_datetime('01-Jan-2000'))
+
+# Clean the input columns in place: missing amounts become 0 and the
+# classification date is parsed, with missing dates set to a default
+def clean_provision_inputs(df):
+    # Fill missing values in key columns with 0 (or use other default values based on the use case)
+    df['TOTAL OS'] = df['TOTAL OS'].fillna(0)
+    df['Collateral after H.C'] = df['Collateral after H.C'].fillna(0)
+    df['Unsecured Portion Covered by ECF/DCF'] = df['Unsecured Portion Covered by ECF/DCF'].fillna(0)
+    df['Existing ECL held Q3\'24'] = df['Existing ECL held Q3\'24'].fillna(0)
+    
+    # Ensure 'Classification Date' column is in datetime format, fill any NaT (Not a Time) values with a default date if necessary
+    with instrumentation.stage("parse dates", rows=len(df)):
+        df['Classification Date'] = parse_classification_dates(df['Classification date'])
+
+# Rate for Min. Provision Required on NUSP (B): 100% once the run date is at
+# least 4 years after the CRMS issue date, 25% before that
+def unsecured_provision_rate(crms_issue_date, run_date):
+    four_years_after_crms = crms_issue_date + timedelta(days=4*365)  # Add 4 years to CRMS issue date
+    return 1 if run_date >= four_years_after_crms else 0.25
+
+# Clean the input columns in place and work out the date-dependent inputs:
+# years since NPL per loan and the rate applied to the unsecured portion
+def prepare_provision_inputs(df, crms_issue_date_str, run_date_str):
+    # Convert date columns to datetime objects
+    crms_issue_date = convert_to_date(crms_issue_date_str)
+    run_date = convert_to_date(run_date_str)
+    
+    clean_provision_inputs(df)
+
+    # Calculate the years since NPL (whole days, as in calculate_years_since_npl)
+    years_since_npl = (run_date - df['Classification Date']).dt.days.to_numpy(dtype=float) / 365
+
+    return years_since_npl, unsecured_provision_rate(crms_issue_date, run_date)
+
+# Provision rules on whole columns: every step is a columnar numpy operation
+# instead of a row-wise df.apply, returned as {column name: values} in output order
+def compute_provision_columns(total_os, collateral, ecf_dcf, existing_ecl, years_since_npl, unsecured_rate):
+    columns = {'Years Since NPL': years_since_npl}
+    
+    # Calculate Unsecured Portion
+    unsecured = np.maximum(total_os - collateral, 0)
+    columns['Unsecured Portion (as whole)'] = unsecured
+    
+    # Calculate NET SECURED Portion
+    net_secured = np.minimum(collateral, total_os)
+    columns['NET SECURED Portion'] = net_secured
+    
+    # Calculate NET Unsecured Portion (NUSP)
+    nusp = unsecured - ecf_dcf
+    columns['NET Unsecured Portion (NUSP)'] = nusp
+    
+    # Calculate Min. Provision Required on NUSP (A)
+    columns['Min. Provision Required on NUSP (A)'] = nusp
+    
+    # Calculate Min. Provision Required on NUSP (B)
+    nusp_b = unsecured * unsecured_rate
+    columns['Min. Provision Required on NUSP (B)'] = nusp_b
+    
+    # Calculate final provision for Unsecured Portion
+    provision_unsecured = np.maximum(nusp, nusp_b)
+    columns['Provision Unsecured Portion'] = provision_unsecured
+    
+    # Calculate Min. Provision on entire SECURED Portion
+    provision_secured = np.where(years_since_npl > 4, net_secured * 0.25, 0.0)
+    columns['Min. Provision on entire SECURED Portion'] = provision_secured
+    
+    # Calculate FINAL Required Provision/ECL CRMS
+    final_provision = provision_unsecured + provision_secured
+    columns['FINAL Required Provision/ECL CRMS'] = final_provision
+    
+    # Calculate Final Calculated ECL with Q3 2024 floor
+    columns['Final Calculated ECL with Q3 2024 floor'] = np.maximum(final_provision, existing_ecl)
+    
+    # Calculate ratio of Existing ECL Q3'24 to Total OS
+    ratio = np.divide(existing_ecl, total_os, out=np.zeros_like(existing_ecl), where=total_os != 0)
+    columns['Ratio Existing ECL Q3\'24 to Total OS'] = ratio
+    
+    # Calculate Final ECL with OS considered based on the updated condition
+    columns['Final ECL with OS considered'] = np.where(
+        ratio > 1,
+        np.maximum(final_provision, total_os),
+        np.maximum(final_provision, existing_ecl)
+    )
+    
+    return columns
+
+# Columns added by compute_provision_columns, in output order
+PROVISION_COLUMNS = [
+    'Years Since NPL', 'Unsecured Portion (as whole)', 'NET SECURED Portion', 'NET Unsecured Portion (NUSP)',
+    'Min. Provision Required on NUSP (A)', 'Min. Provision Required on NUSP (B)', 'Provision Unsecured Portion',
+    'Min. Provision on entire SECURED Portion', 'FINAL Required Provision/ECL CRMS',
+    'Final Calculated ECL with Q3 2024 floor', 'Ratio Existing ECL Q3\'24 to Total OS', 'Final ECL with OS considered',
+]
+
+# Provision columns that hold the final results; the others are intermediate steps
+FINAL_PROVISION_COLUMNS = ['FINAL Required Provision/ECL CRMS', 'Final Calculated ECL with Q3 2024 floor', 'Final ECL with OS considered']
+
+# Columns of a result set without the intermediate steps: the input columns
+# as uploaded and the final results
+def final_columns(df_result):
+    intermediate = set(PROVISION_COLUMNS) - set(FINAL_PROVISION_COLUMNS) | {'Classification Date'}
+    return [col for col in df_result.columns if col not in intermediate]
+
+# Main calculation function
+def calculate_provisions(df, crms_issue_date_str, run_date_str):
+    with instrumentation.stage("prepare inputs", rows=len(df)):
+        years_since_npl, unsecured_rate = prepare_provision_inputs(df, crms_issue_date_str, run_date_str)
+
+    with instrumentation.stage("provision rules", rows=len(df)):
+        total_os, collateral, ecf_dcf, existing_ecl = (df[col].to_numpy(dtype=float) for col in INPUT_COLUMNS)
+        columns = compute_provision_columns(total_os, collateral, ecf_dcf, existing_ecl, years_since_npl, unsecured_rate)
+
+    with instrumentation.stage("assign columns", rows=len(df)):
+        for name, values in columns.items():
+            df[name] = values
+    
+    return df
+
+# Same result as calculate_provisions, with the provision rules applied to
+# blocks of block_rows loans and progress(rows done, rows) called after each
+# block, so long runs can report progress (and be stopped by progress raising)
+def calculate_provisions_in_blocks(df, crms_issue_date_str, run_date_str, block_rows=100_000, progress=None):
+    n_rows = len(df)
+    with instrumentation.stage("prepare inputs", rows=n_rows):
+        years_since_npl, unsecured_rate = prepare_provision_inputs(df, crms_issue_date_str, run_date_str)
+    if progress is not None:
+        progress(0, n_rows)
+
+    inputs = [df[col].to_numpy(dtype=float) for col in INPUT_COLUMNS] + [years_since_npl]
+    outputs = {name: np.empty(n_rows) for name in PROVISION_COLUMNS}
+    with instrumentation.stage("provision rules", rows=n_rows):
+        for start in range(0, n_rows, block_rows):
+            stop = min(start + block_rows, n_rows)
+            columns = compute_provision_columns(*(values[start:stop] for values in inputs), unsecured_rate)
+            for name, values in columns.items():
+                outputs[name][start:stop] = values
+            if progress is not None:
+                progress(stop, n_rows)
+
+    with instrumentation.stage("assign columns", rows=n_rows):
+        for name in PROVISION_COLUMNS:
+            df[name] = outputs[name]
+    return df
+
+# Portfolio totals of a calculated result set
+def provision_totals(df_result):
+    return {
+        'Loans': len(df_result),
+        'TOTAL OS': float(df_result['TOTAL OS'].sum()),
+        'Final ECL with OS considered': float(df_result['Final ECL with OS considered'].sum()),
+    }
+
+# Add (sign=1) or remove (sign=-1) the totals of some rows to running totals, in place
+def update_totals(totals, row_totals, sign=1):
+    for name, value in row_totals.items():
+        totals[name] += sign * value
+    return totals
+
+# Chunked calculation for files larger than memory: read the input in bounded
+# chunks, calculate each chunk independently (the provision rules are row-wise)
+# and write the results to output_file (a path or binary file) as they come,
+# keeping running portfolio totals. The output is CSV unless export_format
+# names another chunked format of result_export (compressed CSV, Parquet);
+# final_only leaves out the intermediate columns. progress(rows done) is
+# called after each chunk.
+def calculate_provisions_chunked(input_file, output_file, crms_issue_date_str, run_date_str, chunksize=100_000, progress=None, export_format="CSV", final_only=False):
+    import data_io
+    import result_export
+    totals = {'Loans': 0, 'TOTAL OS': 0.0, 'Final ECL with OS considered': 0.0}
+    with result_export.ChunkWriter(output_file, export_format) as writer:
+        for chunk in data_io.iter_chunks(input_file, chunksize, schema=INPUT_SCHEMA):
+            chunk = calculate_provisions(chunk, crms_issue_date_str, run_date_str)
+            with instrumentation.stage("write chunk", rows=len(chunk)):
+                writer.write(chunk[final_columns(chunk)] if final_only else chunk)
+
+            update_totals(totals, provision_totals(chunk))
+            if progress is not None:
+                progress(totals['Loans'])
+    return totals
+
+# Incremental update of a previous result set. The delta holds changed or new
+# facilities in the input layout, keyed by id_col; rows whose action_col is
+# "Remove" drop the facility instead. The delta rows are calculated from
+# their new inputs; the kept rows are recalculated from their stored inputs,
+# since years since NPL and the NUSP (B) rate move with the run date (daily
+# runs). Changed facilities keep their position, new ones are appended, and
+# the running totals (from provision_totals) are updated in place.
+def apply_provision_delta(previous_result, delta, id_col, crms_issue_date_str, run_date_str, totals=None, action_col='Action'):
+    if previous_result[id_col].duplicated().any():
+        raise ValueError(f"Duplicate values in '{id_col}' of the previous results")
+    if delta[id_col].duplicated().any():
+        raise ValueError(f"Duplicate values in '{id_col}' of the delta file")
+    if totals is None:
+        totals = provision_totals(previous_result)
+
+    if action_col in delta.columns:
+        removed = delta[action_col].astype(str).str.strip().str.lower().eq('remove').to_numpy()
+    else:
+        removed = np.zeros(len(delta), dtype=bool)
+    upserts = delta.loc[~removed].drop(columns=[action_col], errors='ignore')
+    recalculated = calculate_provisions(upserts.copy(), crms_issue_date_str, run_date_str)
+
+    # Kept facilities at the new dates (the provision rules are columnar, so
+    # this is cheap next to reading the book)
+    affected = previous_result[id_col].isin(delta[id_col]).to_numpy()
+    kept = calculate_provisions(previous_result.loc[~affected].copy(), crms_issue_date_str, run_date_str)
+
+    # Changed facilities take the position of their previous row, new ones go last
+    previous_positions = pd.Index(previous_result[id_col]).get_indexer(recalculated[id_col])
+    new_rows = previous_positions < 0
+    previous_positions[new_rows] = len(previous_result) + np.arange(new_rows.sum())
+    positions = np.concatenate([np.flatnonzero(~affected), previous_positions])
+
+    result = pd.concat([kept, recalculated], ignore_index=True)
+    result = result.iloc[np.argsort(positions, kind='stable')].reset_index(drop=True)
+
+    # Every row may have changed, so the previous totals are swapped for the new ones
+    update_totals(totals, provision_totals(previous_result), sign=-1)
+    update_totals(totals, provision_totals(result))
+    return result, totals
+
+# Check an incrementally updated result set against a full recalculation:
+# the delta is applied to the input columns of the previous results by ID
+# (upserts replace or add facilities, removals drop them), the whole book is
+# recalculated and compared with the updated results row by row on the ID.
+# Facilities missing from the results, left in them after removal, or with
+# stale provision values are counted, and the running totals are compared
+# with the totals of the recalculation.
+def check_provision_delta(previous_result, delta, result, totals, id_col, crms_issue_date_str, run_date_str, action_col='Action', rtol=1e-9):
+    input_cols = [col for col in delta.columns if col != action_col]
+    missing_inputs = [col for col in input_cols if col not in previous_result.columns]
+    if missing_inputs:
+        raise ValueError(f"The previous results are missing the delta columns: {', '.join(missing_inputs)}")
+
+    if action_col in delta.columns:
+        removed = delta[action_col].astype(str).str.strip().str.lower().eq('remove').to_numpy()
+    else:
+        removed = np.zeros(len(delta), dtype=bool)
+    previous_inputs = previous_result.loc[~previous_result[id_col].isin(delta[id_col]), input_cols]
+    inputs = pd.concat([previous_inputs, delta.loc[~removed, input_cols]], ignore_index=True)
+    full = calculate_provisions(inputs, crms_issue_date_str, run_date_str)
+
+    expected = full.set_index(id_col)[PROVISION_COLUMNS]
+    actual = result.set_index(id_col)[PROVISION_COLUMNS]
+    missing = expected.index.difference(actual.index)
+    unexpected = actual.index.difference(expected.index)
+    common = expected.index.intersection(actual.index)
+    expected_values = expected.loc[common].to_numpy(dtype=float)
+    actual_values = actual.loc[common].to_numpy(dtype=float)
+    mismatched = ~np.isclose(actual_values, expected_values, rtol=rtol, atol=0, equal_nan=True).all(axis=1)
+    differences = np.abs(actual_values - expected_values)
+
+    full_totals = provision_totals(full)
+    totals_match = all(np.isclose(totals[name], full_totals[name], rtol=rtol, atol=0) for name in full_totals)
+    return {
+        'Rows match': len(missing) == 0 and len(unexpected) == 0 and not mismatched.any(),
+        'Missing rows': len(missing),
+        'Unexpected rows': len(unexpected),
+        'Mismatched rows': int(mismatched.sum()),
+        'Totals match': totals_match,
+        'Max abs difference': float(np.nanmax(differences, initial=0.0)),
+    }
+
+# Quarter-end run dates following start_date_str, as DD-MMM-YYYY strings
+def quarter_end_dates(start_date_str, years=5):
+    start_date = pd.Timestamp(convert_to_date(start_date_str))
+    return [(start_date + pd.offsets.QuarterEnd(i)).strftime("%d-%b-%Y") for i in range(1, 4 * years + 1)]
+
+# Provision totals for every (CRMS issue date, run date) pair in one broadcast
+# pass over a loans x scenarios matrix. Loans are processed in blocks of
+# block_rows so the matrices stay bounded for large books. Returns one
+# summary row per scenario.
+def calculate_provision_sweep(df, crms_issue_date_strs, run_date_strs, block_rows=100_000):
+    clean_provision_inputs(df)
+
+    scenarios = [(crms_str, run_str) for crms_str in crms_issue_date_strs for run_str in run_date_strs]
+    run_dates = np.array([np.datetime64(convert_to_date(run_str), 'ns') for _, run_str in scenarios])
+    rates = np.array([
+        unsecured_provision_rate(convert_to_date(crms_str), convert_to_date(run_str))
+        for crms_str, run_str in scenarios
+    ], dtype=float)
+
+    classification_dates = df['Classification Date'].to_numpy(dtype='datetime64[ns]')
+    total_os, collateral, ecf_dcf, existing_ecl = (df[col].to_numpy(dtype=float) for col in INPUT_COLUMNS)
+
+    summed_columns = ['FINAL Required Provision/ECL CRMS', 'Final Calculated ECL with Q3 2024 floor', 'Final ECL with OS considered']
+    totals = {name: np.zeros(len(scenarios)) for name in summed_columns}
+    loans_over_four_years = np.zeros(len(scenarios), dtype=np.int64)
+    one_day = np.timedelta64(1, 'D')
+    for start in range(0, len(df), block_rows):
+        block = slice(start, start + block_rows)
+
+        # Whole days between classification and each run date (floored, as Timedelta.days)
+        days = (run_dates[None, :] - classification_dates[block, None]) // one_day
+        years_since_npl = days / 365
+
+        columns = compute_provision_columns(
+            total_os[block, None], collateral[block, None], ecf_dcf[block, None], existing_ecl[block, None],
+            years_since_npl, rates[None, :]
+        )
+        for name in summed_columns:
+            totals[name] += np.broadcast_to(columns[name], years_since_npl.shape).sum(axis=0)
+        loans_over_four_years += (years_since_npl > 4).sum(axis=0)
+
+    summary = pd.DataFrame({
+        'CRMS Issue Date': [crms_str for crms_str, _ in scenarios],
+        'Run Date': pd.to_datetime(run_dates),
+        'Loans over 4 Years Since NPL': loans_over_four_years,
+        'TOTAL OS': float(total_os.sum()),
+    })
+    for name in summed_columns:
+        summary[name] = totals[name]
+    return summary
+
+# Worker for calculate_provisions_parallel: attach to the shared blocks, clean
+# and parse the inputs of rows [start, stop) (classification_dates holds the
+# raw dates of these rows), calculate them and write the cleaned amounts,
+# parsed dates and results straight back into shared memory
+def _calculate_partition(input_name, dates_name, output_name, n_rows, start, stop, classification_dates, run_date, unsecured_rate):
+    started = time.perf_counter()
+    input_block = shared_memory.SharedMemory(name=input_name)
+    dates_block = shared_memory.SharedMemory(name=dates_name)
+    output_block = shared_memory.SharedMemory(name=output_name)
+    try:
+        inputs = np.ndarray((len(INPUT_COLUMNS), n_rows), dtype=np.float64, buffer=input_block.buf)
+        dates = np.ndarray(n_rows, dtype='datetime64[ns]', buffer=dates_block.buf)
+        outputs = np.ndarray((len(PROVISION_COLUMNS), n_rows), dtype=np.float64, buffer=output_block.buf)
+
+        amounts = inputs[:, start:stop]
+        amounts[np.isnan(amounts)] = 0
+        parsed = parse_classification_dates(classification_dates)
+        dates[start:stop] = parsed.to_numpy(dtype='datetime64[ns]')
+        years_since_npl = (run_date - parsed).dt.days.to_numpy(dtype=float) / 365
+
+        columns = compute_provision_columns(*amounts, years_since_npl, unsecured_rate)
+        for i, values in enumerate(columns.values()):
+            outputs[i, start:stop] = values
+        del inputs, dates, outputs, amounts
+    finally:
+        input_block.close()
+        dates_block.close()
+        output_block.close()
+    return time.perf_counter() - started, os.getpid()
+
+# Multi-core calculation: split the loans into contiguous partitions and run
+# them in a process pool (with up to `workers` processes from the job
+# runner's process budget). Amounts, dates and results live in shared memory;
+# each worker fills the missing amounts and parses the classification dates
+# of its own partition, so only partition bounds and the raw dates of the
+# partition travel between processes and the rows keep their order. Returns
+# the result DataFrame (the same as calculate_provisions) and per-partition
+# timings. progress(rows done, rows) is called as partitions finish.
+def calculate_provisions_parallel(df, crms_issue_date_str, run_date_str, workers=None, partitions=None, progress=None):
+    workers = workers or os.cpu_count() or 1
+    partitions = partitions or workers
+    run_date = convert_to_date(run_date_str)
+    unsecured_rate = unsecured_provision_rate(convert_to_date(crms_issue_date_str), run_date)
+
+    n_rows = len(df)
+    input_block = shared_memory.SharedMemory(create=True, size=max(1, 8 * len(INPUT_COLUMNS) * n_rows))
+    dates_block = shared_memory.SharedMemory(create=True, size=max(1, 8 * n_rows))
+    output_block = shared_memory.SharedMemory(create=True, size=max(1, 8 * len(PROVISION_COLUMNS) * n_rows))
+    try:
+        inputs = np.ndarray((len(INPUT_COLUMNS), n_rows), dtype=np.float64, buffer=input_block.buf)
+        for i, col in enumerate(INPUT_COLUMNS):
+            inputs[i] = df[col].to_numpy(dtype=float)
+        del inputs
+
+        bounds = np.linspace(0, n_rows, partitions + 1).astype(int)
+        with job_runner.runner.process_pool(workers) as pool:
+            futures = [
+                pool.submit(
+                    _calculate_partition, input_block.name, dates_block.name, output_block.name, n_rows, start, stop,
+                    df['Classification date'].iloc[start:stop], run_date, unsecured_rate
+                )
+                for start, stop in zip(bounds[:-1], bounds[1:])
+            ]
+            timings = []
+            for partition, ((start, stop), future) in enumerate(zip(zip(bounds[:-1], bounds[1:]), futures)):
+                seconds, pid = future.result()
+                timings.append({'Partition': partition, 'Rows': stop - start, 'Seconds': seconds, 'Worker PID': pid})
+                if progress is not None:
+                    progress(int(stop), n_rows)
+
+        inputs = np.ndarray((len(INPUT_COLUMNS), n_rows), dtype=np.float64, buffer=input_block.buf)
+        for i, col in enumerate(INPUT_COLUMNS):
+            df[col] = inputs[i].copy()
+        dates = np.ndarray(n_rows, dtype='datetime64[ns]', buffer=dates_block.buf)
+        df['Classification Date'] = dates.copy()
+        outputs = np.ndarray((len(PROVISION_COLUMNS), n_rows), dtype=np.float64, buffer=output_block.buf)
+        for i, name in enumerate(PROVISION_COLUMNS):
+            df[name] = outputs[i].copy()
+        del inputs, dates, outputs
+    finally:
+        for block in (input_block, dates_block, output_block):
+            block.close()
+            block.unlink()
+
+    return df, pd.DataFrame(timings)
+
+# Output format from the --format option or the output file extension
+def output_format(output_path, output_format=None):
+    if output_format:
+        return output_format
+    extension = os.path.splitext(output_path)[1].lower().lstrip(".")
+    return extension if extension in OUTPUT_FORMATS else "csv"
+
+# Write a result set in one of OUTPUT_FORMATS
+def write_result(df, output_path, output_format="csv"):
+    if output_format == "parquet":
+        df.to_parquet(output_path, index=False)
+    elif output_format == "feather":
+        df.reset_index(drop=True).to_feather(output_path)
+    else:
+        df.to_csv(output_path, index=False)
+
+# Command-line entry point for batch runs. Prints the portfolio totals and the
+# time spent importing, reading, calculating and writing to stderr.
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Calculate minimum provisions under the CRMS guidelines.")
+    parser.add_argument("input", help="Input CSV, Parquet or Feather file")
+    parser.add_argument("--crms-issue-date", required=True, help="CRMS issue date (DD-MMM-YYYY)")
+    parser.add_argument("--run-date", required=True, help="Run date (DD-MMM-YYYY)")
+    parser.add_argument("--output", required=True, help="Output file")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, help="Output format (default: from the output file extension)")
+    parser.add_argument("--chunksize", type=int, help="Process the input in chunks of this many rows (CSV or Parquet output)")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes (not with --chunksize)")
+    args = parser.parse_args(argv)
+
+    kind = output_format(args.output, args.format)
+    timings = {"Import": IMPORT_SECONDS}
+    started = time.perf_counter()
+
+    if args.chunksize:
+        if kind not in CHUNKED_FORMATS:
+            parser.error(f"--chunksize cannot write {kind} output")
+        if args.workers > 1:
+            parser.error("--chunksize runs in one process; it cannot be combined with --workers")
+        totals = calculate_provisions_chunked(args.input, args.output, args.crms_issue_date, args.run_date, chunksize=args.chunksize, export_format=CHUNKED_FORMATS[kind])
+        timings["Calculate"] = time.perf_counter() - started
+    else:
+        df = load_data(args.input)
+        timings["Read"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        if args.workers > 1:
+            df_result, _ = calculate_provisions_parallel(df, args.crms_issue_date, args.run_date, workers=args.workers)
+        else:
+            df_result = calculate_provisions(df, args.crms_issue_date, args.run_date)
+        timings["Calculate"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        write_result(df_result, args.output, kind)
+        timings["Write"] = time.perf_counter() - started
+        totals = provision_totals(df_result)
+
+    for name, value in totals.items():
+        print(f"{name}: {value:,.2f}" if isinstance(value, float) else f"{name}: {value:,}", file=sys.stderr)
+    print("Seconds: " + ", ".join(f"{name} {seconds:.3f}" for name, seconds in timings.items()), file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
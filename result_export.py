@@ -0,0 +1,159 @@
+import importlib.util
+import io
+import os
+import tempfile
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Results up to this size stay in memory while they are written; larger ones
+# spill to a temporary file on disk
+SPOOL_MAX_BYTES = 32 * 1024 * 1024
+
+# Rows serialized at a time
+EXPORT_CHUNK_ROWS = 100_000
+
+# Excel is only offered for result sets up to this many rows
+EXCEL_MAX_ROWS = 100_000
+
+# Export formats: file extension and MIME type
+EXPORT_FORMATS = {
+    "CSV (gzip)": (".csv.gz", "application/gzip"),
+    "CSV (zstd)": (".csv.zst", "application/zstd"),
+    "Parquet": (".parquet", "application/vnd.apache.parquet"),
+    "CSV": (".csv", "text/csv"),
+    "Excel": (".xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+}
+
+_CSV_CODECS = {"CSV (gzip)": "gzip", "CSV (zstd)": "zstd", "CSV": None}
+
+# Excel needs openpyxl or XlsxWriter, which are optional
+EXCEL_AVAILABLE = any(importlib.util.find_spec(engine) for engine in ("openpyxl", "xlsxwriter"))
+
+
+# Formats offered for a result set of the given size; rows=None (a result
+# that is written while it is calculated) leaves out Excel
+def export_formats(rows):
+    return [
+        name for name in EXPORT_FORMATS
+        if name != "Excel" or (EXCEL_AVAILABLE and rows is not None and rows <= EXCEL_MAX_ROWS)
+    ]
+
+
+# Writable view of a file that Arrow may close without closing the file
+class _KeepOpen(io.RawIOBase):
+    def __init__(self, raw):
+        self.raw = raw
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self.raw.write(data)
+
+
+# Rows of df in chunks of chunk_rows; an empty frame is one empty chunk
+def _chunks(df, chunk_rows):
+    for start in range(0, max(len(df), 1), chunk_rows):
+        yield df.iloc[start:start + chunk_rows]
+
+
+# Parquet schema of a result set written in chunks, from its first chunk.
+# The type of text columns and of columns still empty in the first chunk can
+# differ between chunks (missing values read as floats), so they are stored
+# as strings.
+def _chunk_schema(df):
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    for i, field in enumerate(schema):
+        if pa.types.is_null(field.type) or pa.types.is_large_string(field.type) or df[field.name].isna().all():
+            schema = schema.set(i, pa.field(field.name, pa.string()))
+    return schema.remove_metadata()
+
+
+# Chunk with the column types of the schema: string columns hold text (or
+# missing values) and columns with only missing values become nulls of any type
+def _conform_chunk(df, schema):
+    columns = {}
+    for field in schema:
+        col = df[field.name]
+        if col.isna().all():
+            columns[field.name] = pd.Series([None] * len(col), index=col.index, dtype=object)
+        elif pa.types.is_string(field.type) and not pd.api.types.is_string_dtype(col):
+            columns[field.name] = col.astype(object).map(str, na_action="ignore")
+    return df.assign(**columns) if columns else df
+
+
+# Writer of a result set that arrives chunk by chunk, in any export format
+# but Excel, to a path or a binary file. Only the given columns are written.
+# CSV gets its header with the first chunk; Parquet takes its schema from
+# the first chunk (see _chunk_schema) and fits later chunks to it.
+class ChunkWriter:
+    def __init__(self, file, export_format, columns=None):
+        if export_format not in _CSV_CODECS and export_format != "Parquet":
+            raise ValueError(f"Cannot write {export_format} in chunks")
+        self.export_format = export_format
+        self.columns = columns
+        self.file = open(file, "wb") if isinstance(file, (str, os.PathLike)) else None
+        self.sink = pa.PythonFile(_KeepOpen(self.file or file), mode="w")
+        codec = _CSV_CODECS.get(export_format)
+        self.stream = pa.CompressedOutputStream(self.sink, codec) if codec else self.sink
+        self.parquet_writer = None
+        self.header = True
+
+    def write(self, df):
+        if self.columns is not None:
+            df = df[self.columns]
+        if self.export_format == "Parquet":
+            if self.parquet_writer is None:
+                self.schema = _chunk_schema(df)
+                self.parquet_writer = pq.ParquetWriter(self.stream, self.schema)
+            self.parquet_writer.write_table(pa.Table.from_pandas(_conform_chunk(df, self.schema), schema=self.schema, preserve_index=False))
+        else:
+            self.stream.write(df.to_csv(index=False, header=self.header).encode("utf-8"))
+        self.header = False
+
+    def close(self):
+        try:
+            if self.parquet_writer is not None:
+                self.parquet_writer.close()
+            self.stream.close()
+        finally:
+            if self.file is not None:
+                self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+
+# Serialize a result set in the given format, chunk by chunk, into a spooled
+# temporary file (in memory up to SPOOL_MAX_BYTES, on disk beyond). Only the
+# given columns are written. Returns the file positioned at its start; the
+# caller closes it.
+def export_frame(df, export_format, columns=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    if columns is not None:
+        df = df[columns]
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    try:
+        if export_format == "Excel":
+            with pd.ExcelWriter(spool) as writer:
+                df.to_excel(writer, index=False)
+        else:
+            with ChunkWriter(spool, export_format) as writer:
+                for chunk in _chunks(df, chunk_rows):
+                    writer.write(chunk)
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+
+# Bytes of an export, for a download; the temporary file is removed at once
+def export_bytes(df, export_format, columns=None):
+    with export_frame(df, export_format, columns) as spool:
+        return spool.read()
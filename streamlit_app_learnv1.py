@@ -2,113 +2,219 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 
+import chart_data
+import data_io
+import instrumentation
+import profiling
+import type_inference
+import upload_cache
+
 # Function to load data
 def load_data(file):
     if file is not None:
         try:
-            df = pd.read_csv(file)
+            df = upload_cache.read_table(file)
         except Exception as e:
             st.error(f"Error: {e}")
             return None
         return df
     return None
 
-# Function to detect and display data types with option to change
-def detect_and_display_dtypes(df):
+# Function to detect and display data types with option to change. Types are
+# inferred from a sample of the rows and shown as suggestions next to the
+# current types, which stay the default until the user picks another. The
+# choices are kept as a lazy conversion plan (per upload, in the session) and
+# columns are only converted when a panel asks for them.
+def detect_and_display_dtypes(df, cache_key=None):
     st.write("### Detected Data Types")
-    dtypes = df.dtypes
-    dtype_changes = {}  # Store changes to data types
-
-    # Display data types and provide options to change
-    for col in df.columns:
-        current_dtype = str(dtypes[col])
-        new_dtype = st.selectbox(
-            f"Change '{col}' from {current_dtype} to:",
-            ["object", "int64", "float64", "datetime64[ns]"],
-            index=["object", "int64", "float64", "datetime64[ns]"].index(current_dtype),
-            key=f"dtype_{col}"
+    plan_key = f"conversion_plan_{cache_key}"
+    if plan_key not in st.session_state:
+        st.session_state[plan_key] = type_inference.ConversionPlan.from_sample(
+            df, cache=upload_cache.cache if cache_key else None, data_key=cache_key
         )
-        if new_dtype != current_dtype:
-            dtype_changes[col] = new_dtype
+    plan = st.session_state[plan_key]
 
-    # Apply changes to data types
-    for col, new_dtype in dtype_changes.items():
-        try:
-            if new_dtype == "datetime64[ns]":
-                df[col] = pd.to_datetime(df[col], errors='coerce')
-            else:
-                df[col] = df[col].astype(new_dtype)
-        except Exception as e:
-            st.error(f"Error converting {col} to {new_dtype}: {e}")
+    current_types = [str(dtype) for dtype in df.dtypes]
+    types = pd.DataFrame({
+        "Column": [str(col) for col in df.columns],
+        "Current": current_types,
+        "Suggested": [plan.inferred[col][0] for col in df.columns],
+        "Date format": [plan.inferred[col][1] or "" for col in df.columns],
+        "Convert to": [plan.targets[col] for col in df.columns],
+    })
+    options = list(dict.fromkeys(type_inference.TYPE_OPTIONS + current_types))
+    edited = st.data_editor(
+        types,
+        column_config={"Convert to": st.column_config.SelectboxColumn(options=options, required=True)},
+        disabled=["Column", "Current", "Suggested", "Date format"],
+        hide_index=True,
+        key=f"dtypes_{cache_key}",
+    )
+    for col, new_dtype in zip(df.columns, edited["Convert to"]):
+        plan.set_target(col, new_dtype)
+
+    return plan
 
-    return df
+# Function to apply the conversion plan to the columns a panel needs
+def typed_columns(df, plan, columns=None):
+    df_typed, errors = plan.frame(df, columns)
+    for col, e in errors.items():
+        st.error(f"Error converting {col} to {plan.targets[col]}: {e}")
+    return df_typed
 
-# Function to calculate statistics
-def calculate_statistics(df):
+# Function to display a one-pass streaming profile (approximate quantiles,
+# distinct counts and top values)
+def display_profile(profile):
+    st.caption(
+        f"Approximate profile of {profile.rows:,} rows: quantiles within {profile.relative_accuracy:.1%}, "
+        f"distinct counts from HyperLogLog, top {profile.top_k} values per categorical column."
+    )
     st.write("### Statistics for Numerical Variables")
-    numerical_cols = df.select_dtypes(include=[np.number]).columns
-    if len(numerical_cols) > 0:
-        st.write(df[numerical_cols].describe())
+    numeric_summary = profile.numeric_summary()
+    if len(numeric_summary.columns) > 0:
+        st.write(numeric_summary)
     else:
         st.write("No numerical columns found.")
 
     st.write("### Frequency for Categorical Variables")
-    categorical_cols = df.select_dtypes(include=["object"]).columns
-    if len(categorical_cols) > 0:
-        for col in categorical_cols:
+    categorical_summary = profile.categorical_summary()
+    if categorical_summary:
+        for col, (distinct, top_values, error) in categorical_summary.items():
+            st.write(f"Frequency for {col} (about {distinct:,} distinct values):")
+            if error:
+                # Approximate counts: show them as ranges of the true count
+                st.caption(f"Counts may be up to {error:,} too low; values seen at most {error:,} times are not shown.")
+                top_values = pd.DataFrame({"At least": top_values, "At most": top_values + error})
+            st.write(top_values)
+    else:
+        st.write("No categorical columns found.")
+
+    st.write("### Min and Max Dates")
+    date_ranges = profile.date_ranges()
+    if date_ranges:
+        for col, (min_date, max_date) in date_ranges.items():
+            st.write(f"Min and Max dates for {col}:")
+            st.write(f"Min: {min_date}, Max: {max_date}")
+    else:
+        st.write("No date columns found.")
+
+# Function to calculate statistics: exact for inputs up to
+# profiling.EXACT_MAX_ROWS rows, one-pass streaming profile above that
+def calculate_statistics(df, exact=None, **accuracy):
+    if exact is None:
+        exact = len(df) <= profiling.EXACT_MAX_ROWS
+    if not exact:
+        display_profile(profiling.profile_chunks(profiling.iter_frame(df), **accuracy))
+        return
+
+    statistics = profiling.exact_statistics(df)
+    st.write("### Statistics for Numerical Variables")
+    if statistics["numeric"] is not None:
+        st.write(statistics["numeric"])
+    else:
+        st.write("No numerical columns found.")
+
+    st.write("### Frequency for Categorical Variables")
+    if statistics["categorical"]:
+        for col, counts in statistics["categorical"].items():
             st.write(f"Frequency for {col}:")
-            st.write(df[col].value_counts())
+            st.write(counts)
     else:
         st.write("No categorical columns found.")
 
     st.write("### Min and Max Dates")
-    date_cols = df.select_dtypes(include=["datetime64[ns]"]).columns
-    if len(date_cols) > 0:
-        for col in date_cols:
+    if statistics["dates"]:
+        for col, (min_date, max_date) in statistics["dates"].items():
             st.write(f"Min and Max dates for {col}:")
-            st.write(f"Min: {df[col].min()}, Max: {df[col].max()}")
+            st.write(f"Min: {min_date}, Max: {max_date}")
     else:
         st.write("No date columns found.")
 
-# Function to plot data using Streamlit's built-in functions
-def plot_data(df):
+# Function to plot data using Streamlit's built-in functions. Columns are
+# chosen by their planned types and only the selected ones are converted.
+# Charts are reduced before they are sent to the browser: line charts are
+# decimated to max_points (min/max per bucket) and bar charts capped at
+# max_bars. The reduced series are cached per column when a cache_key (the
+# upload's content hash) is given.
+def plot_data(df, plan, cache_key=None, max_points=chart_data.DEFAULT_MAX_POINTS, max_bars=chart_data.DEFAULT_MAX_BARS):
     st.write("### Data Visualization")
+    schema = plan.schema(df)
+
+    def reduced(kind, series, compute):
+        if cache_key is None:
+            return compute()
+        key = ("chart", cache_key, kind, series.name, str(series.dtype), max_points, max_bars)
+        return upload_cache.cache.get_or_compute(key, compute)
 
     # Plot numerical columns
-    numerical_cols = df.select_dtypes(include=[np.number]).columns
+    numerical_cols = schema.select_dtypes(include=[np.number]).columns
     if len(numerical_cols) > 0:
         st.write("#### Numerical Columns")
         selected_num_col = st.selectbox("Select a numerical column to plot:", numerical_cols)
-        st.line_chart(df[selected_num_col])
+        series = typed_columns(df, plan, [selected_num_col])[selected_num_col]
+        if pd.api.types.is_numeric_dtype(series):
+            st.line_chart(reduced("line", series, lambda: chart_data.minmax_downsample(series, max_points)))
 
     # Plot categorical columns
-    categorical_cols = df.select_dtypes(include=["object"]).columns
+    categorical_cols = schema.select_dtypes(include=["object"]).columns
     if len(categorical_cols) > 0:
         st.write("#### Categorical Columns")
         selected_cat_col = st.selectbox("Select a categorical column to plot:", categorical_cols)
-        st.bar_chart(df[selected_cat_col].value_counts())
+        series = typed_columns(df, plan, [selected_cat_col])[selected_cat_col]
+        st.bar_chart(reduced("bar", series, lambda: chart_data.top_counts(series.value_counts(), max_bars)))
 
 # Main function
 def main():
     st.title("Data Analysis with Streamlit")
     
     # Upload file
-    uploaded_file = st.file_uploader("Upload a CSV file", type=["csv"])
+    uploaded_file = st.file_uploader("Upload a CSV, Parquet or Feather file", type=data_io.UPLOAD_TYPES)
     
+    # Accuracy of the approximate (streaming) profile
+    st.sidebar.write("### Profile Accuracy")
+    accuracy = {
+        "relative_accuracy": st.sidebar.number_input("Quantile relative accuracy", min_value=0.001, max_value=0.2, value=profiling.DEFAULT_RELATIVE_ACCURACY, step=0.005, format="%.3f"),
+        "hll_precision": st.sidebar.slider("Distinct count precision (bits)", min_value=8, max_value=18, value=profiling.DEFAULT_HLL_PRECISION),
+        "top_k": st.sidebar.number_input("Top values per categorical column", min_value=1, max_value=1000, value=profiling.DEFAULT_TOP_K),
+    }
+
+    if uploaded_file is not None and st.checkbox("Profile the file in chunks without loading it (large files)"):
+        # One pass over the file with bounded memory; the profile is cached per upload
+        with instrumentation.stage("streaming profile"):
+            profile = upload_cache.cache.get_or_compute(
+                ("profile", upload_cache.content_hash(uploaded_file), tuple(sorted(accuracy.items()))),
+                lambda: profiling.profile_chunks(data_io.iter_chunks(uploaded_file, 500_000), **accuracy)
+            )
+            instrumentation.set_rows(profile.rows)
+        display_profile(profile)
+        return
+
     if uploaded_file is not None:
-        df = load_data(uploaded_file)
+        with instrumentation.stage("load data"):
+            df = load_data(uploaded_file)
+            instrumentation.set_rows(len(df) if df is not None else None)
         if df is not None:
             st.write("### Loaded Data")
             st.write(df.head())
             
-            # Detect and display data types with option to change
-            df = detect_and_display_dtypes(df)
-            
-            # Calculate statistics
-            calculate_statistics(df)
+            # Detect and display data types with option to change; the loaded
+            # DataFrame is shared through the upload cache and is not modified
+            file_hash = upload_cache.content_hash(uploaded_file)
+            with instrumentation.stage("infer types", rows=len(df)):
+                plan = detect_and_display_dtypes(df, cache_key=file_hash)
+
+            # Calculate statistics on all columns with their planned types
+            with instrumentation.stage("statistics", rows=len(df)):
+                with instrumentation.stage("convert types", rows=len(df)):
+                    df_typed = typed_columns(df, plan)
+                calculate_statistics(df_typed, **accuracy)
 
-            # Plot data
-            plot_data(df)
+            # Plot data; only the plotted columns are converted
+            with instrumentation.stage("plot data", rows=len(df)):
+                plot_data(df, plan, cache_key=file_hash)
 
 if __name__ == "__main__":
+    recorder = instrumentation.session_recorder("data_analysis")
     main()
+    instrumentation.show_sidebar_panel(recorder)
+    st.sidebar.write("Upload Cache:", upload_cache.cache.stats())
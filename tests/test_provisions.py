@@ -0,0 +1,184 @@
+# Parity of the columnar provision calculation with the original row-wise
+# implementation. Run from the repository root:
+#
+#   python -m pytest tests
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import benchmarks
+import provisions
+
+CRMS_ISSUE_DATE = "31-Oct-2020"
+
+# Run dates on both sides of the switch of the NUSP (B) rate, which is 100%
+# from 4 x 365 days after the CRMS issue date and 25% before
+SWITCH_DATE = datetime.strptime(CRMS_ISSUE_DATE, "%d-%b-%Y") + timedelta(days=4 * 365)
+RUN_DATES = [
+    (SWITCH_DATE - timedelta(days=365)).strftime("%d-%b-%Y"),
+    (SWITCH_DATE - timedelta(days=1)).strftime("%d-%b-%Y"),
+    SWITCH_DATE.strftime("%d-%b-%Y"),
+    "30-Sep-2025",
+]
+
+
+# The original calculate_provisions, applied row by row with df.apply
+def calculate_provisions_rowwise(df, crms_issue_date_str, run_date_str):
+    crms_issue_date = datetime.strptime(crms_issue_date_str, "%d-%b-%Y")
+    run_date = datetime.strptime(run_date_str, "%d-%b-%Y")
+
+    df['TOTAL OS'] = df['TOTAL OS'].fillna(0)
+    df['Collateral after H.C'] = df['Collateral after H.C'].fillna(0)
+    df['Unsecured Portion Covered by ECF/DCF'] = df['Unsecured Portion Covered by ECF/DCF'].fillna(0)
+    df['Existing ECL held Q3\'24'] = df['Existing ECL held Q3\'24'].fillna(0)
+
+    df['Classification Date'] = pd.to_datetime(df['Classification date'], errors='coerce').fillna(pd.to_datetime('01-Jan-2000'))
+
+    df['Years Since NPL'] = df['Classification Date'].apply(lambda x: (run_date - x).days / 365)
+    df['Unsecured Portion (as whole)'] = df.apply(
+        lambda row: max(row['TOTAL OS'] - row['Collateral after H.C'], 0), axis=1
+    )
+    df['NET SECURED Portion'] = df.apply(
+        lambda row: min(row['Collateral after H.C'], row['TOTAL OS']), axis=1
+    )
+    df['NET Unsecured Portion (NUSP)'] = df['Unsecured Portion (as whole)'] - df['Unsecured Portion Covered by ECF/DCF']
+    df['Min. Provision Required on NUSP (A)'] = df['NET Unsecured Portion (NUSP)']
+    four_years_after_crms = crms_issue_date + timedelta(days=4*365)
+    df['Min. Provision Required on NUSP (B)'] = df.apply(
+        lambda row: row['Unsecured Portion (as whole)'] * 1 if run_date >= four_years_after_crms else row['Unsecured Portion (as whole)'] * 0.25,
+        axis=1
+    )
+    df['Provision Unsecured Portion'] = df.apply(
+        lambda row: max(row['Min. Provision Required on NUSP (A)'], row['Min. Provision Required on NUSP (B)']),
+        axis=1
+    )
+    df['Min. Provision on entire SECURED Portion'] = df.apply(
+        lambda row: row['NET SECURED Portion'] * 0.25 if row['Years Since NPL'] > 4 else 0,
+        axis=1
+    )
+    df['FINAL Required Provision/ECL CRMS'] = df['Provision Unsecured Portion'] + df['Min. Provision on entire SECURED Portion']
+    df['Final Calculated ECL with Q3 2024 floor'] = df.apply(
+        lambda row: max(row['FINAL Required Provision/ECL CRMS'], row['Existing ECL held Q3\'24']),
+        axis=1
+    )
+    df['Ratio Existing ECL Q3\'24 to Total OS'] = df.apply(
+        lambda row: row['Existing ECL held Q3\'24'] / row['TOTAL OS'] if row['TOTAL OS'] != 0 else 0,
+        axis=1
+    )
+    df['Final ECL with OS considered'] = df.apply(
+        lambda row: max(row['FINAL Required Provision/ECL CRMS'], row['TOTAL OS']) if row['Ratio Existing ECL Q3\'24 to Total OS'] > 1
+        else max(row['FINAL Required Provision/ECL CRMS'], row['Existing ECL held Q3\'24']),
+        axis=1
+    )
+    return df
+
+
+# Synthetic loans with the edge cases of the rules: missing amounts, zero
+# OS (with and without an existing ECL), ECL above OS, missing and bad
+# classification dates, and loans classified exactly 4 years (and a day
+# more or less) before the run date
+def portfolio(run_date_str, rows=2000, seed=1):
+    df = benchmarks.synthetic_portfolio(rows, seed)[['Loan ID', 'Classification date'] + provisions.INPUT_COLUMNS].copy()
+    rng = np.random.default_rng(seed)
+    for col in provisions.INPUT_COLUMNS:
+        df.loc[rng.random(rows) < 0.02, col] = np.nan
+    df.loc[rng.random(rows) < 0.02, 'TOTAL OS'] = 0.0
+    df.loc[rng.random(rows) < 0.02, "Existing ECL held Q3'24"] = df['TOTAL OS'] * 1.5
+
+    # The original parsing guesses the date format from the first date, so
+    # the first row gets a date whose month name is not also a full name
+    run_date = datetime.strptime(run_date_str, "%d-%b-%Y")
+    dates = df['Classification date'].to_numpy(dtype=object, copy=True)
+    dates[0] = "15-Jan-2015"
+    dates[1:7] = ["not a date", "31-Feb-2020", "", None, "00-Jan-2020", "15-Foo-2019"]
+    dates[7:10] = [(run_date - timedelta(days=days)).strftime("%d-%b-%Y") for days in (4 * 365 - 1, 4 * 365, 4 * 365 + 1)]
+    df['Classification date'] = pd.Series(dates, index=df.index, dtype=object)
+    return df
+
+
+# Columnar implementations that must give the row-wise results
+IMPLEMENTATIONS = {
+    "calculate_provisions": provisions.calculate_provisions,
+    "calculate_provisions_in_blocks": lambda df, crms, run: provisions.calculate_provisions_in_blocks(df, crms, run, block_rows=300),
+    "calculate_provisions_parallel": lambda df, crms, run: provisions.calculate_provisions_parallel(df, crms, run, workers=2, partitions=3)[0],
+}
+
+
+@pytest.mark.parametrize("implementation", list(IMPLEMENTATIONS))
+@pytest.mark.parametrize("run_date_str", RUN_DATES)
+def test_matches_rowwise(implementation, run_date_str):
+    df = portfolio(run_date_str)
+    expected = calculate_provisions_rowwise(df.copy(), CRMS_ISSUE_DATE, run_date_str)
+    result = IMPLEMENTATIONS[implementation](df.copy(), CRMS_ISSUE_DATE, run_date_str)
+
+    pd.testing.assert_series_equal(result['Classification Date'], expected['Classification Date'], check_dtype=False)
+    pd.testing.assert_frame_equal(
+        result[provisions.PROVISION_COLUMNS], expected[provisions.PROVISION_COLUMNS],
+        check_dtype=False, rtol=1e-12,
+    )
+
+
+def test_edge_cases_are_covered():
+    before, after = RUN_DATES[1], RUN_DATES[2]
+    assert provisions.unsecured_provision_rate(provisions.convert_to_date(CRMS_ISSUE_DATE), provisions.convert_to_date(before)) == 0.25
+    assert provisions.unsecured_provision_rate(provisions.convert_to_date(CRMS_ISSUE_DATE), provisions.convert_to_date(after)) == 1
+
+    result = provisions.calculate_provisions(portfolio(after), CRMS_ISSUE_DATE, after)
+    years = result['Years Since NPL']
+    assert (years > 4).any() and (years <= 4).any()
+    assert (result['TOTAL OS'] == 0).any()
+    assert (result['Ratio Existing ECL Q3\'24 to Total OS'] > 1).any()
+    assert (result['Classification Date'].iloc[1:7] == pd.Timestamp('2000-01-01')).all()
+
+
+# Previous book calculated at one run date and a delta with a changed, a new
+# and a removed facility, applied at a later run date
+def test_apply_provision_delta_matches_full_recalculation():
+    previous_run, run = "20-Oct-2024", "30-Sep-2025"
+    book = portfolio(previous_run, rows=500)
+    previous_result = provisions.calculate_provisions(book.copy(), CRMS_ISSUE_DATE, previous_run)
+
+    changed = book.iloc[[20]].copy()
+    changed['TOTAL OS'] = changed['TOTAL OS'] * 2 + 1
+    new = book.iloc[[30]].copy()
+    new['Loan ID'] = 10_000
+    removed = book.iloc[[40]].copy()
+    removed['Action'] = 'Remove'
+    delta = pd.concat([changed, new, removed], ignore_index=True)
+
+    result, totals = provisions.apply_provision_delta(previous_result, delta, 'Loan ID', CRMS_ISSUE_DATE, run)
+
+    check = provisions.check_provision_delta(previous_result, delta, result, totals, 'Loan ID', CRMS_ISSUE_DATE, run)
+    assert check['Rows match'] and check['Totals match'], check
+    assert list(result['Loan ID']) == [loan for loan in book['Loan ID'] if loan != 40] + [10_000]
+
+    expected = provisions.calculate_provisions(
+        pd.concat([book[~book['Loan ID'].isin([20, 40])], changed, new]).copy(), CRMS_ISSUE_DATE, run
+    ).set_index('Loan ID').loc[result['Loan ID']]
+    np.testing.assert_allclose(
+        result[provisions.PROVISION_COLUMNS].to_numpy(dtype=float), expected[provisions.PROVISION_COLUMNS].to_numpy(dtype=float)
+    )
+
+
+# The check catches stale, missing and left-over rows
+def test_check_provision_delta_finds_wrong_rows():
+    run = "30-Sep-2025"
+    book = portfolio(run, rows=200)
+    previous_result = provisions.calculate_provisions(book.copy(), CRMS_ISSUE_DATE, run)
+    changed = book.iloc[[5]].copy()
+    changed['TOTAL OS'] = changed['TOTAL OS'] * 3 + 1
+    removed = book.iloc[[6]].copy()
+    removed['Action'] = 'Remove'
+    delta = pd.concat([changed, removed], ignore_index=True)
+    result, totals = provisions.apply_provision_delta(previous_result, delta, 'Loan ID', CRMS_ISSUE_DATE, run)
+
+    def check(rows):
+        return provisions.check_provision_delta(previous_result, delta, rows, totals, 'Loan ID', CRMS_ISSUE_DATE, run)
+
+    stale = result.copy()
+    stale.loc[stale['Loan ID'] == 5, provisions.PROVISION_COLUMNS] = previous_result.loc[previous_result['Loan ID'] == 5, provisions.PROVISION_COLUMNS].to_numpy()
+    assert check(stale)['Mismatched rows'] == 1
+    assert check(pd.concat([result, previous_result[previous_result['Loan ID'] == 6]]))['Unexpected rows'] == 1
+    assert check(result[result['Loan ID'] != 7])['Missing rows'] == 1
@@ -0,0 +1,72 @@
+# Chunked result files: a Parquet file written chunk by chunk holds the same
+# data as the calculation on the whole book
+import io
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+import benchmarks
+import provisions
+import result_export
+
+CRMS_ISSUE_DATE = "31-Oct-2020"
+RUN_DATE = "30-Sep-2025"
+
+
+# Book with a sparse text column, empty in its first rows, so the first
+# chunks read it as all-missing floats and later chunks as text
+@pytest.fixture
+def book_path(tmp_path):
+    df = benchmarks.synthetic_portfolio(1000)[['Loan ID', 'Classification date'] + provisions.INPUT_COLUMNS]
+    comments = np.array([None] * len(df), dtype=object)
+    comments[200::7] = "watchlist"
+    df = df.assign(Comment=comments)
+    path = tmp_path / "book.csv"
+    df.to_csv(path, index=False)
+    return path
+
+
+@pytest.mark.parametrize("export_format", ["Parquet", "CSV (gzip)", "CSV"])
+def test_chunked_output_matches_full_calculation(book_path, tmp_path, export_format):
+    output_path = tmp_path / ("result" + result_export.EXPORT_FORMATS[export_format][0])
+    totals = provisions.calculate_provisions_chunked(
+        str(book_path), str(output_path), CRMS_ISSUE_DATE, RUN_DATE, chunksize=100, export_format=export_format
+    )
+
+    if export_format == "Parquet":
+        result = pd.read_parquet(output_path)
+    else:
+        with pa.input_stream(str(output_path), compression="gzip" if export_format == "CSV (gzip)" else None) as f:
+            result = pd.read_csv(io.BytesIO(f.read()))
+    expected = provisions.calculate_provisions(pd.read_csv(book_path), CRMS_ISSUE_DATE, RUN_DATE)
+
+    assert totals['Loans'] == len(expected) == len(result)
+    assert list(result.columns) == list(expected.columns)
+    assert (result['Comment'].fillna("") == expected['Comment'].fillna("")).all()
+    np.testing.assert_array_equal(result['Loan ID'], expected['Loan ID'])
+    np.testing.assert_allclose(
+        result[provisions.PROVISION_COLUMNS].to_numpy(dtype=float), expected[provisions.PROVISION_COLUMNS].to_numpy(dtype=float)
+    )
+
+
+def test_parquet_chunks_with_changing_types():
+    spool = io.BytesIO()
+    with result_export.ChunkWriter(spool, "Parquet") as writer:
+        writer.write(pd.DataFrame({'Loan ID': [1, 2], 'Comment': [np.nan, np.nan], 'Date': [np.nan, np.nan]}))
+        writer.write(pd.DataFrame({'Loan ID': [3, 4], 'Comment': ["watchlist", None], 'Date': pd.to_datetime(["2024-01-31", None])}))
+    result = pd.read_parquet(io.BytesIO(spool.getvalue()))
+    assert list(result['Loan ID']) == [1, 2, 3, 4]
+    assert result['Comment'].tolist()[2] == "watchlist" and result['Comment'].isna().sum() == 3
+
+
+# The command line writes chunked output in the format of the output file
+def test_cli_chunked_parquet(book_path, tmp_path):
+    output_path = tmp_path / "result.parquet"
+    provisions.main([str(book_path), "--crms-issue-date", CRMS_ISSUE_DATE, "--run-date", RUN_DATE, "--output", str(output_path), "--chunksize", "300"])
+    result = pd.read_parquet(output_path)
+    expected = provisions.calculate_provisions(pd.read_csv(book_path), CRMS_ISSUE_DATE, RUN_DATE)
+    np.testing.assert_allclose(
+        result[provisions.PROVISION_COLUMNS].to_numpy(dtype=float), expected[provisions.PROVISION_COLUMNS].to_numpy(dtype=float)
+    )
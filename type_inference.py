@@ -0,0 +1,130 @@
+import numpy as np
+import pandas as pd
+
+# Rows looked at to infer the type of each column
+DEFAULT_SAMPLE_ROWS = 5000
+
+# Date formats tried on text columns, most common in our extracts first
+DATE_FORMATS = [
+    "%d-%b-%Y", "%Y-%m-%d", "%d/%m/%Y", "%m/%d/%Y", "%d-%m-%Y", "%Y/%m/%d", "%d.%m.%Y",
+    "%Y-%m-%d %H:%M:%S", "%d-%b-%y", "%b %d, %Y",
+]
+
+# Types offered for each column
+TYPE_OPTIONS = ["object", "int64", "float64", "datetime64[ns]", "bool", "category"]
+
+
+# Bounded random sample of the rows of a DataFrame
+def sample_rows(df, rows=DEFAULT_SAMPLE_ROWS):
+    if len(df) <= rows:
+        return df
+    return df.sample(rows, random_state=0)
+
+
+# Date format under which every non-missing sample value parses, or None
+def infer_date_format(values):
+    values = pd.Series(values).dropna().astype(str)
+    if values.empty:
+        return None
+    for date_format in DATE_FORMATS:
+        if pd.to_datetime(values, format=date_format, errors="coerce").notna().all():
+            return date_format
+    return None
+
+
+# Suggested type of a column from a sample: (type, date format or None).
+# Typed columns keep their type; text columns become numbers or dates when
+# every sampled value parses as one.
+def infer_column_type(sample):
+    dtype = sample.dtype
+    if not (pd.api.types.is_object_dtype(dtype) or pd.api.types.is_string_dtype(dtype)):
+        return str(dtype), None
+
+    values = sample.dropna()
+    if values.empty:
+        return "object", None
+    numbers = pd.to_numeric(values, errors="coerce")
+    if numbers.notna().all():
+        integral = np.all(np.mod(numbers.to_numpy(dtype=float), 1) == 0) and not sample.isna().any()
+        return ("int64" if integral else "float64"), None
+    date_format = infer_date_format(values)
+    if date_format is not None:
+        return "datetime64[ns]", date_format
+    return "object", None
+
+
+# Parse dates once per distinct value with an explicit format. Values that
+# do not parse raise a ValueError rather than becoming missing dates.
+def _to_datetime(series, date_format):
+    codes, uniques = pd.factorize(series)
+    parsed = pd.to_datetime(pd.Series(uniques, dtype=object), format=date_format or "mixed", errors="raise")
+    return pd.Series(parsed.array.take(codes, allow_fill=True), index=series.index, name=series.name)
+
+
+# Convert one column to a type from TYPE_OPTIONS (or its current type).
+# Text that is not a number or date raises a ValueError, so bad values are
+# reported instead of being silently turned into NaN/NaT.
+def convert_column(series, target, date_format=None):
+    if target == str(series.dtype):
+        return series
+    if target == "datetime64[ns]":
+        return _to_datetime(series, date_format).astype(target)
+    if target in ("int64", "float64") and not pd.api.types.is_numeric_dtype(series):
+        series = pd.to_numeric(series, errors="raise")
+    return series.astype(target)
+
+
+# Lazy conversion plan: the target type (and date format) of each column.
+# Targets start at the current types; the inferred types are suggestions the
+# user opts into. Nothing is converted until a column is asked for, and each
+# converted column is kept so it is only converted once per target type: in
+# `cache` (an upload_cache.UploadCache, under data_key) when given, otherwise
+# in the plan.
+class ConversionPlan:
+    def __init__(self, inferred, current, cache=None, data_key=None):
+        self.inferred = inferred  # column -> (type, date format)
+        self.targets = dict(current)  # column -> type
+        self.cache = cache
+        self.data_key = data_key
+        self.converted = {}
+
+    @classmethod
+    def from_sample(cls, df, rows=DEFAULT_SAMPLE_ROWS, cache=None, data_key=None):
+        sample = sample_rows(df, rows)
+        inferred = {col: infer_column_type(sample[col]) for col in df.columns}
+        current = {col: str(dtype) for col, dtype in df.dtypes.items()}
+        return cls(inferred, current, cache=cache, data_key=data_key)
+
+    def set_target(self, col, target):
+        self.targets[col] = target
+
+    # Empty DataFrame with the planned types of the given columns (default
+    # all), to choose columns by type without converting them
+    def schema(self, df, columns=None):
+        columns = list(df.columns) if columns is None else list(columns)
+        return pd.DataFrame({col: pd.Series(dtype=self.targets.get(col, df[col].dtype)) for col in columns})
+
+    def column(self, df, col):
+        target = self.targets.get(col, str(df[col].dtype))
+        if target == str(df[col].dtype):
+            return df[col]
+        date_format = self.inferred.get(col, (None, None))[1]
+        if self.cache is not None:
+            key = ("converted", self.data_key, col, target, date_format)
+            return self.cache.get_or_compute(key, lambda: convert_column(df[col], target, date_format))
+        if (col, target) not in self.converted:
+            self.converted[(col, target)] = convert_column(df[col], target, date_format)
+        return self.converted[(col, target)]
+
+    # DataFrame with the planned types for the given columns (default all).
+    # Columns that fail to convert keep their type; their errors are returned.
+    def frame(self, df, columns=None):
+        columns = list(df.columns) if columns is None else list(columns)
+        data, errors = {}, {}
+        for col in columns:
+            try:
+                data[col] = self.column(df, col)
+            except (ValueError, TypeError) as e:
+                data[col] = df[col]
+                errors[col] = e
+        return pd.DataFrame(data, index=df.index), errors
@@ -0,0 +1,130 @@
+import hashlib
+import sys
+import threading
+import types
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import data_io
+
+# Default size limit of the shared cache
+DEFAULT_MAX_MB = 1024
+
+
+# Hashes of Streamlit uploads by file_id, so a rerun does not hash the same
+# upload again
+_upload_hashes = OrderedDict()
+_MAX_UPLOAD_HASHES = 256
+
+
+# Hash the content of an uploaded file (or any bytes-like object). Datasets
+# opened from the dataset store are already keyed by their content hash.
+def content_hash(uploaded_file):
+    dataset_id = getattr(uploaded_file, "dataset_id", None)
+    if dataset_id is not None:
+        return dataset_id
+
+    file_id = getattr(uploaded_file, "file_id", None)
+    if file_id is not None and file_id in _upload_hashes:
+        return _upload_hashes[file_id]
+
+    data = uploaded_file.getvalue() if hasattr(uploaded_file, "getvalue") else uploaded_file
+    digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+    if file_id is not None:
+        _upload_hashes[file_id] = digest
+        if len(_upload_hashes) > _MAX_UPLOAD_HASHES:
+            _upload_hashes.popitem(last=False)
+    return digest
+
+
+# Approximate in-memory size of a cached value. Containers and objects (such
+# as a profiling.StreamingProfile and its sketches) are sized by what they
+# hold, so the arrays, Series and dicts inside them count in full; objects
+# reached twice count once.
+def estimate_size(value, seen=None):
+    seen = set() if seen is None else seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, (tuple, list, set, frozenset)):
+        return sys.getsizeof(value) + sum(estimate_size(item, seen) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(key, seen) + estimate_size(item, seen) for key, item in value.items())
+    if hasattr(value, "__dict__") and not isinstance(value, (type, types.ModuleType, types.FunctionType)):
+        return sys.getsizeof(value) + estimate_size(vars(value), seen)
+    return sys.getsizeof(value)
+
+
+# Size-bounded LRU cache shared by all sessions of the apps. Entries are keyed
+# by tuples that start with the content hash of the upload, so the same file
+# is only parsed (and the same calculation only run) once. Cached values are
+# shared: callers must copy a DataFrame before modifying it.
+class UploadCache:
+    def __init__(self, max_mb=DEFAULT_MAX_MB):
+        self.max_bytes = max_mb * 1024 * 1024
+        self.entries = OrderedDict()  # key -> (value, size)
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+            self.misses += 1
+
+        # Compute outside the lock so other sessions are not blocked
+        value = compute()
+        size = estimate_size(value)
+
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= self.entries.pop(key)[1]
+            if size <= self.max_bytes:
+                self.entries[key] = (value, size)
+                self.total_bytes += size
+                while self.total_bytes > self.max_bytes:
+                    _, (_, evicted_size) = self.entries.popitem(last=False)
+                    self.total_bytes -= evicted_size
+                    self.evictions += 1
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "Entries": len(self.entries),
+                "Size (MB)": round(self.total_bytes / (1024 * 1024), 1),
+                "Hits": self.hits,
+                "Misses": self.misses,
+                "Evictions": self.evictions,
+                "Hit Rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+# Module-level cache: Streamlit imports this module once per server process,
+# so it survives reruns and is shared between the apps and their sessions
+cache = UploadCache()
+
+
+# Parse an uploaded file once per distinct content (and column selection)
+def read_table(uploaded_file, columns=None, schema=None):
+    key = ("table", content_hash(uploaded_file), repr(columns), repr(schema))
+    return cache.get_or_compute(key, lambda: data_io.read_table(uploaded_file, columns=columns, schema=schema))
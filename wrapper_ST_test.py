@@ -1,4 +1,10 @@
+import urllib.parse
+
 import streamlit as st
+import pandas as pd
+
+import data_io
+import dataset_store
 
 # Wrapper function
 def stress_test_wrapper():
@@ -6,20 +12,37 @@ def stress_test_wrapper():
 
     # Allow file upload of datasets
     st.header("Upload Datasets")
-    uploaded_files = st.file_uploader("Upload your datasets", accept_multiple_files=True)
+    uploaded_files = st.file_uploader("Upload your datasets", type=data_io.UPLOAD_TYPES, accept_multiple_files=True)
 
     # Check if files are uploaded
     if uploaded_files:
-        # Save the uploaded files in session state for later use in specific tests
-        if 'uploaded_data' not in st.session_state:
-            st.session_state.uploaded_data = []
+        # Keep only the dataset IDs in session state; the parsed tables live in
+        # the shared dataset store, and the same content is only stored once
+        if 'dataset_ids' not in st.session_state:
+            st.session_state.dataset_ids = []
 
-        # Append uploaded files to session state
         for file in uploaded_files:
-            st.session_state.uploaded_data.append(file)
+            try:
+                dataset_id = dataset_store.store.add(file)
+            except Exception as e:
+                st.error(f"Error loading {file.name}: {e}")
+                continue
+            if dataset_id not in st.session_state.dataset_ids:
+                st.session_state.dataset_ids.append(dataset_id)
         
         st.success("Files uploaded successfully!")
 
+    # Datasets of this session, by ID
+    dataset_ids = [dataset_id for dataset_id in st.session_state.get('dataset_ids', []) if dataset_id in dataset_store.store]
+    if dataset_ids:
+        st.write("### Datasets")
+        st.dataframe(pd.DataFrame([{"ID": dataset_id, **dataset_store.store.info(dataset_id)} for dataset_id in dataset_ids]), hide_index=True)
+        selected_id = st.selectbox(
+            "Dataset to pass to the stress tests",
+            options=dataset_ids,
+            format_func=lambda dataset_id: f"{dataset_store.store.info(dataset_id)['Name']} ({dataset_id[:8]})"
+        )
+
     # List of stress tests
     tests = {
         'ST1 Stress Test': {
@@ -49,12 +72,19 @@ def stress_test_wrapper():
         if st.button(test_name):
             st.write(f"### {test_name}")
             st.write(test_info['description'])
-            st.write(f"Click [here]({test_info['link']}) to access the full Streamlit app for this stress test.")
-            st.write("The uploaded datasets will be automatically passed to the respective app.")
+            link = test_info['link']
+            if dataset_ids:
+                # The app opens the stored dataset by ID instead of a new upload
+                dataset_store.store.handle(selected_id)
+                link += "?" + urllib.parse.urlencode({"dataset": selected_id})
+            st.write(f"Click [here]({link}) to access the full Streamlit app for this stress test.")
+            st.write("The selected dataset will be automatically passed to the respective app when it runs on this server.")
 
     st.write("### Standalone Option")
     st.write("Alternatively, you can choose to load the datasets manually if you are running a standalone app.")
 
+    st.sidebar.write("Dataset Store:", dataset_store.store.stats())
+
 # Running the wrapper function
 if __name__ == '__main__':
     stress_test_wrapper()